@@ -0,0 +1,163 @@
+import argparse
+import datetime
+import json
+import os
+import random
+import openpyxl
+
+# Comment shapes seen in real invoices by group, {in_n}/{out_n} are filled with times
+COMMENT_SHAPES = {
+    'one_shift': [
+        'Time in: {in_1} - Time out: {out_1}',
+        'Time In: {in_1} – Time Out: {out_1}',
+        'time in {in_1}, time out {out_1}',
+    ],
+    'two_shifts': [
+        'Time in: {in_1} - Time out: {out_1}; Time in: {in_2} - Time out: {out_2}',
+        'Time in: {in_1} - Time out: {out_1}\nTime in: {in_2} - Time out: {out_2}',
+    ],
+    'format_issue': [
+        'Time in: {in_1}',
+        'worked {in_1} to {out_1}',
+        'Time in: {in_1} - Time out: {out_1} and {in_2}',
+        'Meeting with the contracting officer',
+    ],
+}
+
+# Share of valid comments with a lunch break, and how often each kind of error is picked for the rows given an error
+TWO_SHIFT_RATE = 0.3
+ERROR_MIX = {'empty': 1, 'format': 1, 'military': 1, 'conflict': 1, 'overbilled': 1}
+
+
+def format_time(minutes):
+    return f'{minutes // 60:02d}:{minutes % 60:02d}'
+
+
+def good_comment(rnd, shapes, two_shift_rate):
+    """
+    A valid comment and the hours it covers, one or two shifts on quarter hours
+    """
+    start = rnd.randrange(6 * 4, 10 * 4) * 15
+    if rnd.random() >= two_shift_rate:
+        end = start + rnd.randrange(4 * 4, 9 * 4) * 15
+        times = {'in_1': format_time(start), 'out_1': format_time(min(end, 24 * 60 - 1))}
+        return rnd.choice(shapes['one_shift']).format(**times), (end - start) / 60
+
+    lunch = start + rnd.randrange(3 * 4, 5 * 4) * 15
+    back = lunch + rnd.randrange(2, 5) * 15
+    end = back + rnd.randrange(2 * 4, 5 * 4) * 15
+    times = {'in_1': format_time(start), 'out_1': format_time(lunch), 'in_2': format_time(back), 'out_2': format_time(end)}
+    return rnd.choice(shapes['two_shifts']).format(**times), (lunch - start + end - back) / 60
+
+
+def sheet_rows(rnd, rows, employees, days, error_rate, month_start, shapes=COMMENT_SHAPES, two_shift_rate=TWO_SHIFT_RATE,
+               error_mix=ERROR_MIX):
+    """
+    Yield (name, date, hours worked, comment) rows for one charge code sheet, one row per employee and day
+    """
+    error_kinds, error_weights = list(error_mix), list(error_mix.values())
+
+    # Add employees when there are more rows than employee days
+    employees = max(employees, -(-rows // days))
+    row_count = 0
+    for index in range(employees * days):
+        if row_count >= rows:
+            return
+        name = f'Employee {index // days:04d}'
+        date = month_start + datetime.timedelta(days=index % days)
+        comment, hours = good_comment(rnd, shapes, two_shift_rate)
+
+        kind = rnd.choices(error_kinds, error_weights)[0] if rnd.random() < error_rate else None
+        if kind == 'empty':
+            comment = None
+        elif kind == 'format':
+            comment = rnd.choice(shapes['format_issue']).format(in_1='08:00', out_1='16:00', in_2='17:00')
+        elif kind == 'military':
+            comment = 'Time in: 08:00 - Time out: 04:30'
+        elif kind == 'overbilled':
+            hours += rnd.choice([0.5, 1, 2])
+        elif kind == 'conflict' and row_count + 1 < rows:
+            # A second row for the same person and date with different times
+            yield name, date, hours, comment
+            comment, hours = good_comment(rnd, shapes, two_shift_rate)
+            row_count += 1
+
+        yield name, date, hours, comment
+        row_count += 1
+
+
+def generate_invoice(path, charge_codes=3, rows_per_sheet=1000, employees=50, days=28, error_rate=0.2,
+                     month_start=datetime.datetime(2024, 3, 1), seed=0, shapes=None, two_shift_rate=TWO_SHIFT_RATE, error_mix=None):
+    """
+    Write an invoice workbook laid out like the real ones, a title block above the 'Name' header and a total row below the data
+
+    shapes replaces shape groups of COMMENT_SHAPES and error_mix weights the error kinds of ERROR_MIX, kinds left out aren't generated
+    """
+    rnd = random.Random(seed)
+    shapes = {**COMMENT_SHAPES, **(shapes or {})}
+    unknown_groups = set(shapes) - set(COMMENT_SHAPES)
+    if unknown_groups:
+        raise ValueError(f'Unknown shape groups {sorted(unknown_groups)}, expected some of {list(COMMENT_SHAPES)}')
+    unknown_kinds = set(error_mix or {}) - set(ERROR_MIX)
+    if unknown_kinds:
+        raise ValueError(f'Unknown error kinds {sorted(unknown_kinds)}, expected some of {list(ERROR_MIX)}')
+    error_mix = error_mix or ERROR_MIX
+    workbook = openpyxl.Workbook(write_only=True)
+
+    for charge_code in range(charge_codes):
+        worksheet = workbook.create_sheet(f'(ABC{charge_code:05d}.00)')
+        worksheet.append(['Invoice Detail'])
+        worksheet.append([f'Contract ABC {month_start:%B %Y}'])
+        worksheet.append([])
+        worksheet.append(['Name', 'Employee ID', 'Date', 'Hours Worked', 'Time Period'])
+
+        total_hours = 0
+        for name, date, hours, comment in sheet_rows(rnd, rows_per_sheet, employees, days, error_rate, month_start, shapes, two_shift_rate,
+                                                     error_mix):
+            worksheet.append([name, int(name.split()[1]), date, hours, comment])
+            total_hours += hours
+        worksheet.append([None, None, None, total_hours, 'Total'])
+
+    # Blacklisted and hidden sheets are skipped by the reader
+    workbook.create_sheet('(PEN00000.00)').append(['Name'])
+    hidden_sheet = workbook.create_sheet('Notes')
+    hidden_sheet.sheet_state = 'hidden'
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    workbook.save(path)
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write a synthetic invoice workbook')
+    parser.add_argument('path', help='Workbook to write, for example "input/ABC March 2024 Invoice.xlsx"')
+    parser.add_argument('--charge-codes', type=int, default=3)
+    parser.add_argument('--rows-per-sheet', type=int, default=1000)
+    parser.add_argument('--employees', type=int, default=50)
+    parser.add_argument('--days', type=int, default=28)
+    parser.add_argument('--error-rate', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--shapes', metavar='JSON', help=f'JSON file of shape groups replacing the built in ones, groups: {list(COMMENT_SHAPES)}')
+    parser.add_argument('--two-shift-rate', type=float, default=TWO_SHIFT_RATE, help='Share of valid comments with two shifts')
+    parser.add_argument('--error-mix', metavar='KIND=WEIGHT', nargs='+', type=parse_error_weight,
+                        help=f'Relative weight of each error kind, kinds left out are not generated, kinds: {list(ERROR_MIX)}')
+    args = parser.parse_args(argv)
+
+    shapes = None
+    if args.shapes:
+        with open(args.shapes) as file:
+            shapes = json.load(file)
+    generate_invoice(args.path, args.charge_codes, args.rows_per_sheet, args.employees, args.days, args.error_rate, seed=args.seed,
+                     shapes=shapes, two_shift_rate=args.two_shift_rate, error_mix=dict(args.error_mix) if args.error_mix else None)
+
+
+def parse_error_weight(text):
+    kind, _, weight = text.partition('=')
+    try:
+        return kind, float(weight)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'Expected KIND=WEIGHT, got {text}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+import argparse
+import glob
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import pandas as pd
+import utils.utils as ut
+import utils.clean_data as cd
+import utils.format_excel as fe
+import utils.instrumentation as ins
+from benchmarks.invoice_generator import generate_invoice
+
+RESULTS_FOLDER = os.path.join(os.path.dirname(__file__), 'results')
+STAGES = ['generate', 'read', 'calculate_ts', 'find_empty_comments', 'extract_times', 'check_military_time_format',
+          'calculate_time_worked', 'clean_summary_df', 'copy_template', 'paste_all_to_excel', 'format_all_code_sheets',
+          'reconcile_mismatch', 'save']
+
+
+def benchmark_invoice(total_rows, charge_codes, folder, seed=0) -> dict[str, float]:
+    """
+    Run every stage of process_workbook on a generated invoice, calling the stages directly so each one is timed on its own
+    """
+    ins.reset()
+    invoice_filename = 'ABC March 2024 Invoice.xlsx'
+    input_folder = os.path.join(folder, 'input')
+    output_folder = os.path.join(folder, 'output')
+    os.makedirs(output_folder, exist_ok=True)
+
+    with ins.stage('generate'):
+        generate_invoice(os.path.join(input_folder, invoice_filename), charge_codes, total_rows // charge_codes, 50, 28, 0.2)
+
+    with ut.open_input_workbook(invoice_filename, input_folder) as input_workbook:
+        with ins.stage('read'):
+            invoice_sheet_names = ut.list_visible_sheets_in_workbook(input_workbook)
+        with ins.stage('copy_template'):
+            output_workbook = ut.copy_and_rename_excel(invoice_filename, invoice_sheet_names, output_folder)
+        reconciler = cd.MismatchReconciler()
+
+        for invoice_sheet_name in invoice_sheet_names:
+            with ins.stage('read'):
+                import_df = ut.read_excel_data(input_workbook, invoice_sheet_name)
+
+            # The CleanData methods record a stage for each cleaning step
+            dataframes = cd.clean_sheet_data(import_df)
+
+            with ins.stage('reconcile_mismatch'):
+                reconciler.add(dataframes["Summary"])
+            with ins.stage('paste_all_to_excel'):
+                summary_block = ut.paste_all_to_excel(dataframes, output_workbook, invoice_sheet_name)
+            with ins.stage('format_all_code_sheets'):
+                fe.format_all_code_sheets(output_workbook, dataframes, invoice_sheet_name, summary_block)
+
+        with ins.stage('reconcile_mismatch'):
+            overbilled_df = reconciler.reconcile()
+            cd.create_mismatch_sheet(overbilled_df, output_workbook)
+        with ins.stage('save'):
+            output_workbook.save()
+
+    # Wall time of every stage added up over all charge code sheets
+    seconds = {total['stage']: total['wall_seconds'] for total in ins.summarize(ins.drain_records())}
+    return {stage: seconds.get(stage, 0) for stage in STAGES}
+
+
+def latest_results(results_folder=RESULTS_FOLDER) -> dict | None:
+    paths = sorted(glob.glob(os.path.join(results_folder, '*.json')))
+    if not paths:
+        return None
+    with open(paths[-1], encoding='utf-8') as file:
+        return json.load(file)
+
+
+def format_table(results, previous=None) -> str:
+    """
+    One column per size, the change against the previous run is shown next to each time
+    """
+    sizes = list(results['runs'])
+    lines = [f'{"stage":<28}' + ''.join(f'{size + " rows":>24}' for size in sizes)]
+    for stage in STAGES + ['total']:
+        line = f'{stage:<28}'
+        for size in sizes:
+            seconds = results['runs'][size][stage]
+            cell = f'{seconds:.3f}s'
+            previous_seconds = (previous or {}).get('runs', {}).get(size, {}).get(stage)
+            if previous_seconds:
+                cell += f' ({(seconds / previous_seconds - 1) * 100:+.0f}%)'
+            line += f'{cell:>24}'
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time every stage of the invoice pipeline on generated invoices')
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000], help='Total comment rows per generated invoice')
+    parser.add_argument('--charge-codes', type=int, default=4, help='Charge code sheets the rows are split over')
+    parser.add_argument('--repeat', type=int, default=1, help='Runs per size, the fastest time of every stage is kept')
+    parser.add_argument('--no-save', action='store_true', help="Print the results without saving them to benchmarks/results")
+    args = parser.parse_args(argv)
+
+    results = {
+        'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python': sys.version.split()[0],
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'charge_codes': args.charge_codes,
+        'runs': {}
+    }
+    for rows in args.rows:
+        runs = []
+        for _ in range(args.repeat):
+            with tempfile.TemporaryDirectory() as folder:
+                runs.append(benchmark_invoice(rows, args.charge_codes, folder))
+        best = {stage: min(run[stage] for run in runs) for stage in STAGES}
+        best['total'] = round(sum(seconds for stage, seconds in best.items() if stage != 'generate'), 4)
+        results['runs'][str(rows)] = best
+
+    previous = latest_results()
+    print(format_table(results, previous))
+    if previous:
+        print(f'Compared with the run from {previous["timestamp"]}')
+
+    if not args.no_save:
+        os.makedirs(RESULTS_FOLDER, exist_ok=True)
+        path = os.path.join(RESULTS_FOLDER, f'{time.strftime("%Y%m%d-%H%M%S")}.json')
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+        print(f'Saved {path}')
+
+
+if __name__ == '__main__':
+    main()
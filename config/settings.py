@@ -18,3 +18,44 @@ detail_loc = {
 }
 
 blacklist_charge_codes = ['(PEN00000.00)']
+
+# Save the output workbook every n charge codes, 0 only saves once the whole invoice is done
+output_checkpoint_every = 0
+
+# Build the output sheets with 'openpyxl', or 'excel' to copy them through a hidden Excel instance with xlwings
+template_engine = 'openpyxl'
+
+# Cleaned charge code sheets are cached here and reused while the sheet and the code are unchanged, None uses a folder of the
+# current user (%LOCALAPPDATA%\PBGC_Billing_Automation on Windows, ~/.cache/PBGC_Billing_Automation elsewhere)
+cache_folder = None
+
+# Cached sheets unused for cache_max_age_days are removed, then the least recently used ones until the cache fits cache_max_megabytes
+cache_max_age_days = 30
+cache_max_megabytes = 500
+
+# Part of the cache key, bump it with every release. The bundled executable has no sources to fingerprint, so without a bump it
+# would reuse sheets cleaned by an older version
+cache_version = 1
+
+# Watch mode checks the input folder every watch_poll_seconds and waits until a workbook is unchanged for watch_settle_seconds
+watch_poll_seconds = 2
+watch_settle_seconds = 5
+
+# Stage timings of every run are written here, see --trace-memory to include peak memory
+run_report_filename = 'run_report.json'
+
+# Lowest level written to logfile.log, 'DEBUG' adds DataFrame dumps showing at most log_sample_rows rows (0 shows every row)
+log_level = 'INFO'
+log_sample_rows = 20
+
+# Input files picked up from the input folder, .csv and .parquet files are timesheet exports with a 'Charge Code' column
+input_extensions = ['.xlsx', '.xls', '.csv', '.parquet']
+
+# Read workbooks with 'openpyxl' or 'calamine' (the python-calamine package, faster and needed for .xls), 'auto' uses calamine when installed
+input_engine = 'auto'
+
+# Distinct time comments kept parsed in memory, repeated comments across rows, sheets and workbooks are parsed once
+comment_cache_size = 100000
+
+# Data file formats of --export and the extension each one is written with
+export_formats = {'parquet': '.parquet', 'csv': '.csv', 'jsonl': '.jsonl'}
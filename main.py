@@ -1,74 +1,339 @@
-import utils.utils as ut
-import utils.clean_data as cd
-import utils.format_excel as fe
+import utils.batch as bt
+import utils.instrumentation as ins
+import argparse
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
 import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from config.settings import export_formats
 
+# pandas, openpyxl and the modules built on them are imported by the functions that need them, so the executable starts, shows --help
+# and rejects bad arguments without loading them
 
-def main():
-    ut.set_logger()
 
-    # Convert the input string to a list
-    invoice_filenames = ut.find_workbook_list()
-    mismatch_df = None  # Initialize workbook variable
+def process_workbook(invoice_filename, sheet_jobs=1, use_cache=True, input_folder='input', output_folder='output', export_format=None,
+                     skip_formatting=False):
+    import utils.utils as ut
+    import utils.clean_data as cd
+    import utils.format_excel as fe
+    import utils.export_data as ex
 
-    for invoice_filename in invoice_filenames:
-        # Extract invoice sheet names
-        invoice_sheet_names = ut.list_visible_sheets_in_workbook(invoice_filename)
+    with ins.stage('process_workbook', workbook=invoice_filename):
+        # Open the invoice workbook once for every charge code sheet
+        with ut.open_input_workbook(invoice_filename, input_folder) as input_workbook:
+            # Extract invoice sheet names
+            invoice_sheet_names = ut.list_visible_sheets_in_workbook(input_workbook)
 
-        # Copy template and rename the workbook and sheets
-        workbook_filename = ut.copy_and_rename_excel(invoice_filename, invoice_sheet_names)
+            # Copy template and rename the sheets, the output workbook stays in memory until every charge code is done
+            output_workbook = None
+            if not skip_formatting:
+                with ins.stage('copy_and_rename_excel'):
+                    output_workbook = ut.copy_and_rename_excel(invoice_filename, invoice_sheet_names, output_folder)
 
-        for invoice_sheet_name in invoice_sheet_names:
+            # The cleaned frames are also written as data files when an export format is given
+            exporter = ex.DataExporter(invoice_filename, export_format, output_folder) if export_format else None
 
-            # Import data from excel workbook
-            import_df = ut.read_excel_data(invoice_filename, invoice_sheet_name)
+            # Billed vs commented hours are compared across every charge code once all sheets are cleaned
+            reconciler = cd.MismatchReconciler()
 
-            # Intialize class for cleaning data
-            clean_df = cd.CleanData(import_df)
+            # Compute stage, clean every charge code sheet (in parallel when sheet_jobs > 1)
+            with clean_sheets(input_workbook, invoice_sheet_names, sheet_jobs, use_cache) as cleaned_sheets:
 
-            # Calculate T/S
-            clean_df.calculate_ts()
+                # Writer stage, consume the cleaned sheets in the original sheet order
+                for invoice_sheet_name, dataframes in zip(invoice_sheet_names, cleaned_sheets):
+                    reconciler.add(dataframes["Summary"])
+                    if exporter:
+                        exporter.add(invoice_sheet_name, dataframes)
+                    if output_workbook is None:
+                        continue
+                    pasted_rows = sum(len(df.index) for df in dataframes.values())
 
-            # find empty comment
-            empty_comments_df = clean_df.find_empty_comments()
+                    # Paste data from dataframes into worksheets
+                    with ins.stage('paste_all_to_excel', rows_in=pasted_rows, charge_code=invoice_sheet_name):
+                        summary_block = ut.paste_all_to_excel(dataframes, output_workbook, invoice_sheet_name)
 
-            # Extract times from comment
-            format_issue_df = clean_df.extract_times()
+                    # Format worksheets
+                    with ins.stage('format_all_code_sheets', rows_in=pasted_rows, charge_code=invoice_sheet_name):
+                        fe.format_all_code_sheets(output_workbook, dataframes, invoice_sheet_name, summary_block)
 
-            # Check for military time format
-            military_time_issue_df = clean_df.check_military_time_format()
+                    # Save early if a checkpoint policy is set
+                    output_workbook.checkpoint()
 
-            # Calculate time worked
-            differing_time_df, acceptable_df = clean_df.calculate_time_worked()
+            # Calculate total billed vs total commented hours
+            with ins.stage('reconcile_mismatch', rows_in=sum(len(df.index) for df in reconciler.summary_dfs)) as record:
+                overbilled_df = reconciler.reconcile()
+                if output_workbook is not None:
+                    cd.create_mismatch_sheet(overbilled_df, output_workbook)
+                record['rows_out'] = len(overbilled_df.index)
 
-            # Clean and calcualte subtotals for summar sheet
-            final_df = clean_df.clean_summary_df()
+            # Write the data files
+            if exporter:
+                exporter.add_mismatch(overbilled_df)
+                with ins.stage('export_data'):
+                    exporter.write()
 
-            # Extract final dataframe
-            final_df = clean_df.df
+            # Write the output workbook to disk once
+            if output_workbook is not None:
+                with ins.stage('save'):
+                    output_workbook.save()
 
-            # Organize dataframes
-            dataframes = {
-                "Empty": empty_comments_df,
-                "Format": format_issue_df,
-                "Military": military_time_issue_df,
-                "Mismatch": mismatch_df,
-                "ConflictingTime": differing_time_df,
-                "Acceptable": acceptable_df,
-                "Summary": final_df
-            }
 
-            # Calculate total billed vs total commented hours
-            mismatch_df = cd.calc_total_billed_n_comment(invoice_sheet_name, invoice_sheet_names, dataframes, workbook_filename)
+def read_sheet(input_workbook, invoice_sheet_name):
+    import utils.utils as ut
+
+    with ins.stage('read_excel_data', charge_code=invoice_sheet_name) as record:
+        import_df = ut.read_excel_data(input_workbook, invoice_sheet_name)
+        record['rows_out'] = len(import_df.index)
+    return import_df
+
+
+def clean_sheet(invoice_sheet_name, import_df, use_cache=True):
+    import utils.sheet_cache as sc
+
+    with ins.stage('clean_sheet_data', rows_in=len(import_df.index), charge_code=invoice_sheet_name) as record:
+        dataframes = sc.clean_sheet_data_cached(import_df, use_cache)
+        record['rows_out'] = len(dataframes['Summary'].index)
+    return dataframes
+
+
+def clean_sheet_job(invoice_sheet_name, import_df, use_cache=True):
+    """
+    Worker process entry point, the stage records go back to the parent with the dataframes
+    """
+    dataframes = clean_sheet(invoice_sheet_name, import_df, use_cache)
+    return dataframes, ins.drain_records()
+
+
+def init_sheet_worker(log_queue, log_level=logging.INFO, log_sample_rows=None, trace_memory=False):
+    import utils.utils as ut
+
+    ut.set_worker_logger(log_queue, log_level)
+    ut.LazyFrame.max_rows = log_sample_rows
+    ins.reset()
+
+    # The peaks of the stages run here are this worker's own and go back to the parent with the records
+    if trace_memory:
+        ins.start_memory_tracing()
+
+
+def collect_cleaned_sheet(future):
+    dataframes, records = future.result()
+    ins.add_records(records)
+    return dataframes
+
+
+@contextmanager
+def clean_sheets(input_workbook, invoice_sheet_names, sheet_jobs, use_cache=True):
+    """
+    Yield the cleaned dataframes for every charge code sheet in sheet order, unchanged sheets come from the cache
+    """
+    import utils.utils as ut
+
+    if sheet_jobs <= 1 or len(invoice_sheet_names) <= 1:
+        yield (clean_sheet(name, read_sheet(input_workbook, name), use_cache) for name in invoice_sheet_names)
+        return
+
+    # Worker processes log through the parent's handlers and trace memory when this process does
+    log_queue, listener = ut.start_log_listener()
+    try:
+        worker_settings = (log_queue, logging.getLogger().level, ut.LazyFrame.max_rows, ins.tracing_memory())
+        with ProcessPoolExecutor(max_workers=sheet_jobs, initializer=init_sheet_worker, initargs=worker_settings) as executor:
+            # Sheets are read one at a time in this process and cleaned while the next one is read
+            futures = [executor.submit(clean_sheet_job, name, read_sheet(input_workbook, name), use_cache) for name in invoice_sheet_names]
+            yield (collect_cleaned_sheet(future) for future in futures)
+    finally:
+        listener.stop()
+
+
+def process_workbook_job(invoice_filename, log_filename, sheet_jobs=1, use_cache=True, trace_memory=False,
+                         log_level=logging.INFO, log_sample_rows=None, export_format=None, skip_formatting=False):
+    """
+    Worker process entry point, every worker logs to its own file and returns its stage records
+    """
+    import utils.utils as ut
+
+    ut.set_logger(log_filename, console=False, level=log_level, sample_rows=log_sample_rows)
+    ins.reset()
+    if trace_memory:
+        ins.start_memory_tracing()
+    try:
+        process_workbook(invoice_filename, sheet_jobs, use_cache, export_format=export_format, skip_formatting=skip_formatting)
+        return ins.drain_records()
+    except Exception:
+        logging.exception(f'Failed to process {invoice_filename}')
+        raise
+    finally:
+        ut.stop_logger()
+
+
+def process_workbooks_in_parallel(invoice_filenames, jobs, sheet_jobs=1, use_cache=True, trace_memory=False, export_format=None,
+                                  skip_formatting=False) -> list[str]:
+    """
+    Process the invoice workbooks in worker processes, a failing workbook doesn't stop the others and is returned
+    """
+    import utils.utils as ut
+
+    log_folder = tempfile.mkdtemp(prefix='pbgc_logs_')
+    log_filenames = {invoice_filename: os.path.join(log_folder, f'{i}.log') for i, invoice_filename in enumerate(invoice_filenames)}
+    failed_filenames = []
+
+    # Every invoice workbook is independent so each one runs in its own process
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        # Workers log with the same level and sampling as this process
+        log_settings = (logging.getLogger().level, ut.LazyFrame.max_rows, export_format, skip_formatting)
+        futures = {executor.submit(process_workbook_job, invoice_filename, log_filenames[invoice_filename], sheet_jobs, use_cache, trace_memory,
+                                   *log_settings): invoice_filename for invoice_filename in invoice_filenames}
 
-            # Paste data from dataframes into worksheets
-            ut.paste_all_to_excel(dataframes, workbook_filename, invoice_sheet_name)
+        for future in as_completed(futures):
+            invoice_filename = futures[future]
+            try:
+                ins.add_records(future.result())
+                logging.info(f'Completed {invoice_filename}')
+            except Exception as e:
+                failed_filenames.append(invoice_filename)
+                logging.error(f'Failed to process {invoice_filename}: {e}')
 
-            # Format worksheets
-            fe.format_all_code_sheets(workbook_filename, dataframes, invoice_sheet_name)
+    # Merge the worker logs into logfile.log in input order
+    ut.merge_log_files({filename: log for filename, log in log_filenames.items() if os.path.exists(log)})
+    os.rmdir(log_folder)
+
+    if failed_filenames:
+        logging.error(f'{len(failed_filenames)} of {len(invoice_filenames)} workbooks failed: {failed_filenames}')
+    return failed_filenames
+
+
+def process_batch(root, output_root='output', sheet_jobs=1, use_cache=True, export_format=None, skip_formatting=False) -> list[str]:
+    """
+    Process every invoice workbook below root into the same folders below output_root, resuming an interrupted run, returns the failed ones
+    """
+    manifest = bt.BatchManifest(os.path.join(output_root, 'manifest.json'))
+    manifest.sync(root, bt.find_workbook_tree(root, exclude_folder=output_root))
+    unfinished = manifest.unfinished()
+    logging.info(f'{len(unfinished)} of {len(manifest.jobs)} workbooks below {root} are left to process')
+
+    for relative_path in unfinished:
+        input_folder, invoice_filename = os.path.split(os.path.join(root, relative_path))
+        output_folder = os.path.join(output_root, os.path.dirname(relative_path))
+        os.makedirs(output_folder, exist_ok=True)
+
+        # The job stays running in the manifest if the run is interrupted, so it is picked up again on restart
+        manifest.start(relative_path)
+        start_time = time.perf_counter()
+        try:
+            process_workbook(invoice_filename, sheet_jobs, use_cache, input_folder, output_folder, export_format, skip_formatting)
+        except Exception as e:
+            logging.exception(f'Failed to process {relative_path}')
+            manifest.finish(relative_path, time.perf_counter() - start_time, e)
+        else:
+            manifest.finish(relative_path, time.perf_counter() - start_time)
+
+    logging.info(f'Batch finished: {manifest.counts()}')
+    return manifest.failed()
+
+
+def watch_input_folder(sheet_jobs=1, use_cache=True, export_format=None, skip_formatting=False):
+    """
+    Keep processing new or modified invoice workbooks until interrupted, imports and the template are only loaded once
+    """
+    import utils.watch_folder as wf
+
+    watcher = wf.WorkbookWatcher()
+    logging.info('Waiting for invoice workbooks, press Ctrl+C to stop')
+    try:
+        while True:
+            for invoice_filename in watcher.wait_for_workbooks():
+                # A failing workbook is logged and the watcher keeps going
+                try:
+                    process_workbook(invoice_filename, sheet_jobs, use_cache, export_format=export_format, skip_formatting=skip_formatting)
+                    logging.info(f'Completed {invoice_filename}')
+                except Exception:
+                    logging.exception(f'Failed to process {invoice_filename}')
+
+            # The run report covers the workbooks picked up together
+            ins.write_run_report()
+    except KeyboardInterrupt:
+        logging.info('Stopped watching the input folder')
+    finally:
+        watcher.stop()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Organize PBGC invoice workbooks')
+    parser.add_argument('--jobs', type=int, default=1, help='Number of invoice workbooks to process in parallel')
+    parser.add_argument('--sheet-jobs', type=int, default=1, help='Number of charge code sheets to clean in parallel within a workbook')
+    parser.add_argument('--no-cache', dest='use_cache', action='store_false',
+                        help='Clean every charge code sheet again instead of reusing cached results')
+    parser.add_argument('--batch', metavar='ROOT', help='Process every invoice workbook in the folder tree below ROOT, resuming an earlier run')
+    parser.add_argument('--batch-output', metavar='DIR', default='output', help='Folder that mirrors the --batch tree with the organized invoices')
+    parser.add_argument('--watch', action='store_true', help='Keep running and process workbooks as they are added to the input folder')
+    parser.add_argument('--log-level', default=None, choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], help='Override log_level from the settings')
+    parser.add_argument('--log-sample-rows', type=int, default=None, help='Rows shown in DataFrame dumps at DEBUG level, 0 shows every row')
+    parser.add_argument('--trace-memory', action='store_true', help='Add the peak memory of every stage to the run report, this slows the run down')
+    parser.add_argument('--export', dest='export_format', choices=list(export_formats),
+                        help='Also write the issue, summary and mismatch tables of every workbook as data files')
+    parser.add_argument('--skip-formatting', action='store_true', help='Only write the --export data files, without the organized invoice workbook')
+    args = parser.parse_args(argv)
+
+    if args.skip_formatting and not args.export_format:
+        parser.error('--skip-formatting needs --export')
+    if args.export_format:
+        import utils.export_data as ex
+        try:
+            ex.check_export_format(args.export_format)
+        except ImportError as e:
+            parser.error(str(e))
+    return args
+
+
+def main(argv=None) -> int:
+    """
+    Run the program and return its exit status, 1 when a workbook processed in parallel failed
+    """
+    args = parse_args(argv)
+    import utils.utils as ut
+
+    ut.set_logger(level=args.log_level or ut.log_level, sample_rows=args.log_sample_rows)
+    if args.trace_memory:
+        ins.start_memory_tracing()
+
+    try:
+        return run(args)
+    finally:
+        # Log the stage timings and write run_report.json
+        ins.write_run_report()
+
+
+def run(args) -> int:
+    import utils.utils as ut
+
+    if args.batch:
+        failed_paths = process_batch(args.batch, args.batch_output, args.sheet_jobs, args.use_cache, args.export_format, args.skip_formatting)
+        return 1 if failed_paths else 0
+
+    if args.watch:
+        watch_input_folder(args.sheet_jobs, args.use_cache, args.export_format, args.skip_formatting)
+        return 0
+
+    # Convert the input string to a list
+    invoice_filenames = ut.find_workbook_list()
+
+    if args.jobs > 1 and len(invoice_filenames) > 1:
+        failed_filenames = process_workbooks_in_parallel(invoice_filenames, args.jobs, args.sheet_jobs, args.use_cache, args.trace_memory,
+                                                         args.export_format, args.skip_formatting)
+        return 1 if failed_filenames else 0
+
+    for invoice_filename in invoice_filenames:
+        process_workbook(invoice_filename, args.sheet_jobs, args.use_cache, export_format=args.export_format, skip_formatting=args.skip_formatting)
+    return 0
 
 
 if __name__ == '__main__':
-    main()
-    print("Program Completed!\nGoodbye!")
+    multiprocessing.freeze_support()  # Needed for worker processes in the pyinstaller executable
+    exit_status = main()
+    print("Program Completed!\nGoodbye!" if exit_status == 0 else "Some workbooks failed, see logfile.log\nGoodbye!")
     time.sleep(1)  # Gives the end user time to read the message above
+    sys.exit(exit_status)
@@ -0,0 +1,62 @@
+import os
+import tempfile
+import unittest
+from utils.batch import BatchManifest, find_workbook_tree
+
+
+class TestBatchManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = self.temp_dir.name
+        for relative_path in ['ABC/March/ABC March 2024 Invoice.xlsx', 'ABC/March/~$ABC March 2024 Invoice.xlsx', 'DEF March 2024 Invoice.xlsx']:
+            self.write(relative_path)
+        self.manifest_path = os.path.join(self.root, 'output', 'manifest.json')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write(self, relative_path, content=b'workbook'):
+        path = os.path.join(self.root, relative_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as file:
+            file.write(content)
+
+    def test_find_workbook_tree(self):
+        self.write('output/ABC/March/ABC March 2024 Organized Invoice.xlsx')
+
+        self.assertEqual(find_workbook_tree(self.root, exclude_folder=os.path.join(self.root, 'output')),
+                         ['ABC/March/ABC March 2024 Invoice.xlsx', 'DEF March 2024 Invoice.xlsx'])
+
+    def test_resume(self):
+        manifest = BatchManifest(self.manifest_path)
+        manifest.sync(self.root, find_workbook_tree(self.root))
+        manifest.start('ABC/March/ABC March 2024 Invoice.xlsx')
+        manifest.finish('ABC/March/ABC March 2024 Invoice.xlsx', 1.5)
+        manifest.start('DEF March 2024 Invoice.xlsx')
+
+        # A restart skips finished workbooks and picks up the one that was interrupted
+        manifest = BatchManifest(self.manifest_path)
+        manifest.sync(self.root, find_workbook_tree(self.root))
+        self.assertEqual(manifest.unfinished(), ['DEF March 2024 Invoice.xlsx'])
+        self.assertEqual(manifest.jobs['ABC/March/ABC March 2024 Invoice.xlsx']['seconds'], 1.5)
+
+        # A finished workbook that changed is processed again
+        self.write('ABC/March/ABC March 2024 Invoice.xlsx', b'corrected workbook')
+        manifest.sync(self.root, find_workbook_tree(self.root))
+        self.assertEqual(manifest.unfinished(), ['ABC/March/ABC March 2024 Invoice.xlsx', 'DEF March 2024 Invoice.xlsx'])
+
+    def test_failed_jobs_are_retried(self):
+        manifest = BatchManifest(self.manifest_path)
+        manifest.sync(self.root, find_workbook_tree(self.root))
+        manifest.start('DEF March 2024 Invoice.xlsx')
+        manifest.finish('DEF March 2024 Invoice.xlsx', 0.1, ValueError('bad workbook'))
+
+        self.assertEqual(manifest.counts(), {'pending': 1, 'failed': 1})
+        self.assertEqual(manifest.failed(), ['DEF March 2024 Invoice.xlsx'])
+        self.assertEqual(manifest.jobs['DEF March 2024 Invoice.xlsx']['error'], 'bad workbook')
+        self.assertIn('DEF March 2024 Invoice.xlsx', BatchManifest(self.manifest_path).unfinished())
+
+
+if __name__ == '__main__':
+    unittest.main()
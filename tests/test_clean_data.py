@@ -1,6 +1,7 @@
 import pandas as pd
 import unittest
-from utils.clean_data import CleanData, calculate_total_time_difference
+import utils.time_parsing as tp
+from utils.clean_data import CleanData, MismatchReconciler, calculate_total_time_difference
 
 
 class TestCleanDataClass(unittest.TestCase):
@@ -17,6 +18,120 @@ class TestCleanDataClass(unittest.TestCase):
         expected_total_hours = 3 + 4  # Expected total hours
         self.assertEqual(calculate_total_time_difference(in_times, out_times), expected_total_hours)
 
+    def test_calculate_ts(self):
+        dates = ['03/02/2024', '03/03/2024', '03/09/2024', '03/02/2024']
+        clean_data = CleanData(pd.DataFrame({'Date': pd.Categorical(dates)}))
+        clean_data.calculate_ts()
+
+        # Weeks run from Sunday to Saturday
+        self.assertEqual(clean_data.df['T/S'].tolist(), ['02/25/2024 - 03/02/2024', '03/03/2024 - 03/09/2024',
+                                                         '03/03/2024 - 03/09/2024', '02/25/2024 - 03/02/2024'])
+
+    def test_extract_times(self):
+        comments = ['Time in: 08:00 - Time out: 12:00; Time in: 13:00 - Time out: 24:00',
+                    'Time in: 08:00 - Time out: 12:10',
+                    'Time in: 08:00 - Time out: 12:00 and 13:00',
+                    'No times here']
+        df = pd.DataFrame({'Name': 'A', 'T/S': '', 'Date': '01/01/2023', 'Time Period': comments})
+        clean_data = CleanData(df)
+        format_issue_df = clean_data.extract_times()
+
+        self.assertEqual(format_issue_df.index.tolist(), [1, 2, 3])
+
+        # One row per time pair, midnight time outs count as 23:59
+        time_pairs, rows = clean_data.current_time_pairs()
+        self.assertEqual(rows.tolist(), [0, 0])
+        self.assertEqual(time_pairs['Pair'].tolist(), [0, 1])
+        self.assertEqual(time_pairs['In Minutes'].tolist(), [8 * 60, 13 * 60])
+        self.assertEqual(time_pairs['Out Minutes'].tolist(), [12 * 60, 23 * 60 + 59])
+
+    def clean_comments(self, names, comments):
+        df = pd.DataFrame({'Name': names, 'T/S': '', 'Date': '01/01/2023', 'Hours Worked': 4, 'Time Period': comments})
+        clean_data = CleanData(df)
+        clean_data.extract_times()
+        return clean_data
+
+    def test_check_military_time_format(self):
+        comments = ['Time in: 08:00 - Time out: 12:00',
+                    'Time in: 24:15 - Time out: 14:00',
+                    'Time in: 13:00 - Time out: 12:00',
+                    'Time in: 08:00 - Time out: 12:00; Time in: 13:00 - Time out: 00:00']
+        clean_data = self.clean_comments('A', comments)
+        military_time_issue_df = clean_data.check_military_time_format()
+
+        self.assertEqual(military_time_issue_df.index.tolist(), [1, 2])
+        self.assertEqual(clean_data.df.index.tolist(), [0, 3])
+
+    def test_calculate_time_worked(self):
+        comments = ['Time in: 08:00 - Time out: 12:00',
+                    'Time in: 08:00 - Time out: 12:00',
+                    'Time in: 08:00 - Time out: 12:00',
+                    'Time in: 8:00 - Time out: 12:00',
+                    'Time in: 08:00 - Time out: 12:00',
+                    'Time in: 08:00 - Time out: 12:00; Time in: 13:00 - Time out: 14:00']
+        clean_data = self.clean_comments(['A', 'A', 'B', 'B', 'C', 'C'], comments)
+        conflicting_comment_df, acceptable_df = clean_data.calculate_time_worked()
+
+        # Times written differently or with more pairs conflict, like comparing the comment text
+        self.assertEqual(conflicting_comment_df.index.tolist(), [2, 3, 4, 5])
+        self.assertEqual(acceptable_df.index.tolist(), [0, 1])
+        self.assertEqual(clean_data.df['Commented Time Worked'].tolist(), [4, 4])
+        self.assertEqual(acceptable_df['Formatted Time Comments'].tolist(), ['Time in: 08:00 - Time out: 12:00'] * 2)
+
+    def test_calculate_time_worked_pair_order(self):
+        comments = ['Time in: 08:00 - Time out: 12:00; Time in: 13:00 - Time out: 14:00',
+                    'Time in: 13:00 - Time out: 14:00; Time in: 08:00 - Time out: 12:00',
+                    'Time in: 08:00 - Time out: 12:00; Time in: 13:00 - Time out: 14:00',
+                    'Time in: 08:00 - Time out: 12:00; Time in: 13:00 - Time out: 14:00']
+        clean_data = self.clean_comments(['A', 'A', 'B', 'B'], comments)
+        conflicting_comment_df, acceptable_df = clean_data.calculate_time_worked()
+
+        # The same pairs in a different order still conflict
+        self.assertEqual(conflicting_comment_df.index.tolist(), [0, 1])
+        self.assertEqual(acceptable_df.index.tolist(), [2, 3])
+
+
+class TestParseTimeComments(unittest.TestCase):
+
+    def test_parse_cache(self):
+        tp.parse_comment.cache_clear()
+        comments = pd.Series(['Time in: 08:00 - Time out: 12:00', ' TIME IN: 08:00 - TIME OUT: 12:00', 'Time in: 9:00 - Time out: 0:00'])
+        comment_table, pair_table = tp.parse_time_comments(comments)
+        tp.parse_time_comments(comments.iloc[:1])
+
+        # Comments that only differ in case or surrounding spaces are parsed once
+        cache_info = tp.parse_comment.cache_info()
+        self.assertEqual((cache_info.hits, cache_info.misses), (1, 2))
+
+        self.assertEqual(comment_table['Commented Time Worked'].tolist(), [4, 4, 15])
+        self.assertEqual(comment_table['Formatted Time Comments'].tolist(),
+                         ['Time in: 08:00 - Time out: 12:00', 'Time in: 08:00 - Time out: 12:00', 'Time in: 09:00 - Time out: 00:00'])
+        self.assertEqual(pair_table['Row'].tolist(), [0, 1, 2])
+        self.assertEqual(pair_table['Short Hours'].tolist(), [0, 0, tp.SHORT_IN_HOUR])
+
+
+class TestMismatchReconciler(unittest.TestCase):
+
+    def summary_df(self, charge_code, hours_worked, commented_time_worked):
+        return pd.DataFrame({
+            'Name': ['A', 'B'], 'T/S': '', 'Date': '01/01/2023', 'Charge Code': charge_code, 'Time Period': '',
+            'Hours Worked': hours_worked, 'Total Hours Worked': hours_worked, 'Commented Time Worked': commented_time_worked
+        })
+
+    def test_reconcile(self):
+        reconciler = MismatchReconciler()
+        reconciler.add(self.summary_df('(ABC00001.00)', [4, 4], [4, 4]))
+        reconciler.add(self.summary_df('(ABC00002.00)', [4, 4], [4, 2]))
+        overbilled_df = reconciler.reconcile()
+
+        # Hours are summed across every charge code, including the last one added
+        self.assertEqual(overbilled_df['Name'].tolist(), ['B', 'B'])
+        self.assertEqual(overbilled_df['Daily Total Hours Worked'].tolist(), [8, 8])
+        self.assertEqual(overbilled_df['Daily Commented Time Worked'].tolist(), [6, 6])
+
+    def test_reconcile_without_sheets(self):
+        self.assertTrue(MismatchReconciler().reconcile().empty)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,56 @@
+import os
+import tempfile
+import unittest
+import pandas as pd
+from utils.export_data import DataExporter, check_export_format
+
+
+class TestDataExporter(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.output_folder = self.temp_dir.name
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def dataframes(self, names):
+        issue_df = pd.DataFrame({'Name': names, 'T/S': '', 'Date': '01/01/2023', 'Time Period': ''})
+        summary_df = pd.DataFrame({'index': range(len(names)), 'Name': names, 'Date': '01/01/2023', 'Charge Code': 'ignored'})
+        return {'Empty': issue_df, 'Format': issue_df, 'Military': issue_df, 'ConflictingTime': issue_df, 'Acceptable': issue_df,
+                'Summary': summary_df}
+
+    def test_write_csv(self):
+        exporter = DataExporter('ABC March 2024 Invoice.xlsx', 'csv', self.output_folder)
+        exporter.add('(ABC00001.00)', self.dataframes(['A']))
+        exporter.add('(ABC00002.00)', self.dataframes(['B', 'C']))
+        exporter.add_mismatch(pd.DataFrame({'Name': ['B'], 'Charge Code': ['(ABC00002.00)']}))
+        paths = exporter.write()
+
+        folder = os.path.join(self.output_folder, 'ABC March 2024 Data')
+        self.assertEqual(sorted(os.listdir(folder)), sorted(os.path.basename(path) for path in paths))
+
+        # Every record is tagged with its workbook and charge code, the reset_index column is dropped
+        summary_df = pd.read_csv(os.path.join(folder, 'Summary.csv'))
+        self.assertEqual(summary_df.columns.tolist(), ['Workbook', 'Charge Code', 'Name', 'Date'])
+        self.assertEqual(summary_df['Charge Code'].tolist(), ['(ABC00001.00)', '(ABC00002.00)', '(ABC00002.00)'])
+        self.assertEqual(set(summary_df['Workbook']), {'ABC March 2024 Invoice.xlsx'})
+
+        mismatch_df = pd.read_csv(os.path.join(folder, 'Mismatch.csv'))
+        self.assertEqual(mismatch_df.columns.tolist(), ['Workbook', 'Name', 'Charge Code'])
+
+    def test_write_jsonl_without_sheets(self):
+        exporter = DataExporter('ABC March 2024 Invoice.xlsx', 'jsonl', self.output_folder)
+        exporter.add_mismatch(pd.DataFrame())
+        exporter.write()
+
+        # Tables are written even without rows
+        self.assertTrue(os.path.exists(os.path.join(self.output_folder, 'ABC March 2024 Data', 'Empty.jsonl')))
+
+    def test_check_export_format(self):
+        with self.assertRaises(ValueError):
+            check_export_format('xlsx')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+import io
+import tempfile
+import unittest
+from unittest import mock
+import openpyxl
+import pandas as pd
+from openpyxl.styles import Alignment, Border, PatternFill, Side
+from openpyxl.utils import get_column_letter
+from benchmarks.invoice_generator import generate_invoice
+from utils.clean_data import clean_sheet_data
+from utils.format_excel import fill_white_columns, fill_white_cells, create_summary_banded_rows, autosize_columns_worksheet, StyleRegistry
+from utils.format_excel import format_all_code_sheets, combine_borders, sheet_blocks
+from utils.utils import InputWorkbook, OutputWorkbook, clone_template_workbook, paste_all_to_excel, read_excel_data, build_summary_block
+from config.settings import summary_loc, overbilled_loc
+
+
+class TestFormatExcel(unittest.TestCase):
+
+    def setUp(self):
+        workbook = openpyxl.load_workbook('config/sheet_template.xlsx')
+        self.worksheet = workbook['Summary']
+        self.worksheet['B10'] = 'Jane Doe'
+        self.worksheet['B11'] = 'Jane Doe'
+
+    def test_fill_white(self):
+        max_row, max_column = self.worksheet.max_row, self.worksheet.max_column
+        fill_white_columns(self.worksheet)
+        fill_white_cells(self.worksheet)
+
+        # No new cells are created past the data
+        self.assertEqual((self.worksheet.max_row, self.worksheet.max_column), (max_row, max_column))
+        self.assertEqual(self.worksheet['B10'].fill.fgColor.rgb, 'FFFFFFFF')
+        self.assertEqual(self.worksheet.column_dimensions['O'].fill.fgColor.rgb, 'FFFFFFFF')
+
+        # Template column ranges are split so they don't overlap the filled columns
+        ranges = sorted((dimension.min, dimension.max) for dimension in self.worksheet.column_dimensions.values())
+        self.assertTrue(all(previous[1] < current[0] for previous, current in zip(ranges, ranges[1:])))
+
+    def format_generated_sheets(self):
+        # Paste and format the sheets of a generated charge code like process_workbook does
+        with tempfile.TemporaryDirectory() as folder:
+            generate_invoice(f'{folder}/ABC March 2024 Invoice.xlsx', charge_codes=1, rows_per_sheet=60, seed=1)
+            with InputWorkbook('ABC March 2024 Invoice.xlsx', folder=folder) as input_workbook:
+                dataframes = clean_sheet_data(read_excel_data(input_workbook, '(ABC00000.00)'))
+
+        workbook = clone_template_workbook('config/sheet_template.xlsx', ['(ABC00000.00)'])
+        output_workbook = OutputWorkbook('ABC March 2024 Organized Invoice.xlsx', workbook)
+        summary_block = paste_all_to_excel(dataframes, output_workbook, '(ABC00000.00)')
+        format_all_code_sheets(output_workbook, dataframes, '(ABC00000.00)', summary_block)
+        return output_workbook
+
+    def test_summary_block_built_once(self):
+        with mock.patch('utils.utils.build_summary_block', wraps=build_summary_block) as build:
+            self.format_generated_sheets()
+        self.assertEqual(build.call_count, 1)
+
+    def test_format_all_code_sheets_fill(self):
+        output_workbook = self.format_generated_sheets()
+
+        # Every cell of the used range is white, including the cells created while formatting like the subtotal rows, cells that
+        # were never created show the fill of their column
+        for worksheet in output_workbook.workbook.worksheets:
+            if not worksheet.title.startswith('(ABC00000.00)_'):
+                continue
+            for row in range(1, worksheet.max_row + 1):
+                for column in range(1, worksheet.max_column + 1):
+                    if (row, column) in worksheet._cells:
+                        fill = worksheet.cell(row=row, column=column).fill
+                    else:
+                        fill = worksheet.column_dimensions[get_column_letter(column)].fill
+                    self.assertEqual((fill.fill_type, fill.fgColor.rgb), ('solid', 'FFFFFFFF'), f'{worksheet.title} row {row} column {column}')
+
+    def test_format_all_code_sheets_titles_and_divider(self):
+        workbook = self.format_generated_sheets().workbook
+
+        # The title row is centered across the sheet, not only above the data
+        detail_sheet = workbook['(ABC00000.00)_Detail']
+        self.assertEqual({cell.alignment.horizontal for cell in detail_sheet[3]}, {'center'})
+
+        # The row below the summary closes the last name with a divider and is part of the print area
+        summary_sheet = workbook['(ABC00000.00)_Summary']
+        last_row = summary_sheet.max_row
+        self.assertIsNone(summary_sheet[f'B{last_row}'].value)
+        self.assertEqual([summary_sheet[f'{col}{last_row}'].border.top.style for col in 'BCDE'], ['thin'] * 4)
+        self.assertTrue(summary_sheet.print_area.endswith(f'$F${last_row}'))
+
+    def test_create_summary_banded_rows(self):
+        create_summary_banded_rows(self.worksheet, summary_loc)
+
+        rules = {str(conditional_format.sqref): conditional_format.rules for conditional_format in self.worksheet.conditional_formatting}
+        self.assertEqual(list(rules), ['B10:E11'])
+        self.assertEqual(rules['B10:E11'][0].formula, ['AND(MOD(ROW()-10,2)<1,$B10<>"")'])
+
+    def test_autosize_columns_worksheet(self):
+        worksheet = openpyxl.load_workbook('config/sheet_template.xlsx')['Mismatch']
+        overbilled_df = pd.DataFrame({'Name': ['Jane Doe'], 'Time Period': ['x' * 30], 'Comment': ['x' * 100]})
+        autosize_columns_worksheet(worksheet, 'Mismatch', sheet_blocks('Mismatch', overbilled_loc, {'Mismatch': overbilled_df}))
+
+        # Widths come from the dataframe and are kept between 10 and 68
+        self.assertEqual(worksheet.column_dimensions['A'].width, 10)
+        self.assertEqual(worksheet.column_dimensions['C'].width, 32)
+        self.assertEqual(worksheet.column_dimensions['D'].width, 68)
+
+    def test_style_registry(self):
+        workbook = self.worksheet.parent
+        styles = StyleRegistry.for_workbook(workbook)
+        self.assertIs(StyleRegistry.for_workbook(workbook), styles)
+
+        # The combined border is added to the workbook once and shared by every cell
+        border_count = len(workbook._borders)
+        for row in range(20, 30):
+            styles.combine_border(self.worksheet.cell(row=row, column=2), Border(top=Side(style='medium')))
+        self.assertEqual(len(workbook._borders), border_count + 1)
+        self.assertEqual(len({self.worksheet.cell(row=row, column=2)._style.borderId for row in range(20, 30)}), 1)
+        self.assertEqual(self.worksheet['B25'].border.top.style, 'medium')
+
+        # A different overlay on the same current style is a different style
+        styles.combine_border(self.worksheet['C25'], Border(top=Side(style='thin')))
+        self.assertEqual(self.worksheet['C25'].border.top.style, 'thin')
+
+    def test_style_registry_matches_style_setters(self):
+        overlays = [('combine_border', 'border', Border(left=Side(style='medium'))),
+                    ('set_fill', 'fill', PatternFill(fill_type='solid', fgColor='FFCCCCCC')),
+                    ('set_alignment', 'alignment', Alignment(vertical='top'))]
+        styles = StyleRegistry.for_workbook(self.worksheet.parent)
+        reference_sheet = openpyxl.load_workbook('config/sheet_template.xlsx')['Summary']
+        for method, attribute, overlay in overlays:
+            for coordinate in ['B10', 'B9', 'Z40']:
+                getattr(styles, method)(self.worksheet[coordinate], overlay)
+                current_style = getattr(reference_sheet[coordinate], attribute)
+                style = combine_borders(current_style, overlay) if attribute == 'border' else overlay
+                setattr(reference_sheet[coordinate], attribute, style)
+
+        # The interned styles match openpyxl's own setters before and after a save, so an openpyxl release that changes its style
+        # internals fails here
+        for worksheet, reference in [(self.worksheet, reference_sheet), (saved_sheet(self.worksheet), saved_sheet(reference_sheet))]:
+            for coordinate in ['B10', 'B9', 'Z40']:
+                for _, attribute, _ in overlays:
+                    self.assertEqual(getattr(worksheet[coordinate], attribute).copy(), getattr(reference[coordinate], attribute).copy())
+
+
+def saved_sheet(worksheet):
+    # The sheet as read back after saving its workbook
+    buffer = io.BytesIO()
+    worksheet.parent.save(buffer)
+    return openpyxl.load_workbook(buffer)[worksheet.title]
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+import unittest
+import pandas as pd
+import utils.instrumentation as ins
+from utils.clean_data import CleanData
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    def setUp(self):
+        ins.reset()
+
+    def test_stage_labels(self):
+        with ins.stage('process_workbook', workbook='ABC March 2024 Invoice.xlsx'):
+            with ins.stage('paste_all_to_excel', rows_in=10, charge_code='(ABC00001.00)') as record:
+                record['rows_out'] = 8
+
+        paste_record, workbook_record = ins.drain_records()
+        self.assertEqual(paste_record['workbook'], 'ABC March 2024 Invoice.xlsx')
+        self.assertEqual(paste_record['charge_code'], '(ABC00001.00)')
+        self.assertEqual((paste_record['rows_in'], paste_record['rows_out']), (10, 8))
+        self.assertNotIn('charge_code', workbook_record)
+        self.assertEqual(ins.drain_records(), [])
+
+    def test_timed_method(self):
+        clean_data = CleanData(pd.DataFrame({'Name': 'A', 'T/S': '', 'Date': '01/01/2023', 'Time Period': ['x', None]}))
+        clean_data.find_empty_comments()
+
+        summary = ins.summarize(ins.drain_records())
+        self.assertEqual([(total['stage'], total['calls'], total['rows_in'], total['rows_out']) for total in summary],
+                         [('find_empty_comments', 1, 2, 1)])
+
+
+if __name__ == '__main__':
+    unittest.main()
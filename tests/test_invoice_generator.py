@@ -0,0 +1,47 @@
+import tempfile
+import unittest
+from benchmarks.invoice_generator import generate_invoice, main
+from utils.utils import InputWorkbook, read_excel_data
+
+
+class TestInvoiceGenerator(unittest.TestCase):
+
+    def test_generate_invoice(self):
+        with tempfile.TemporaryDirectory() as folder:
+            generate_invoice(f'{folder}/ABC March 2024 Invoice.xlsx', charge_codes=2, rows_per_sheet=50, error_rate=1, seed=1)
+
+            # The generated layout is read the same way as a real invoice
+            with InputWorkbook('ABC March 2024 Invoice.xlsx', folder=folder) as input_workbook:
+                self.assertEqual(input_workbook.visible_sheet_names(), ['(ABC00000.00)', '(ABC00001.00)'])
+                df = read_excel_data(input_workbook, '(ABC00001.00)')
+
+        self.assertEqual(len(df.index), 50)
+        self.assertTrue(df['Date'].str.startswith('03/').all())
+        self.assertTrue(df['Time Period'].isna().any())
+
+    def test_comment_mix(self):
+        with tempfile.TemporaryDirectory() as folder:
+            # Only format issues from the given shapes, and only two shift comments on the other rows
+            generate_invoice(f'{folder}/ABC March 2024 Invoice.xlsx', charge_codes=1, rows_per_sheet=200, error_rate=0.5, seed=1,
+                             shapes={'format_issue': ['Lunch meeting'], 'two_shifts': ['{in_1}-{out_1} {in_2}-{out_2}']}, two_shift_rate=1,
+                             error_mix={'format': 1})
+            with InputWorkbook('ABC March 2024 Invoice.xlsx', folder=folder) as input_workbook:
+                comments = read_excel_data(input_workbook, '(ABC00000.00)')['Time Period']
+
+        self.assertTrue(comments.notna().all())
+        self.assertTrue((comments == 'Lunch meeting').any())
+        self.assertTrue(comments.str.fullmatch(r'Lunch meeting|\d\d:\d\d-\d\d:\d\d \d\d:\d\d-\d\d:\d\d').all())
+
+        with self.assertRaises(ValueError):
+            generate_invoice(f'{folder}/ABC March 2024 Invoice.xlsx', error_mix={'typo': 1})
+
+    def test_main_error_mix(self):
+        with tempfile.TemporaryDirectory() as folder:
+            main([f'{folder}/ABC March 2024 Invoice.xlsx', '--charge-codes', '1', '--rows-per-sheet', '50', '--error-rate', '1',
+                  '--error-mix', 'empty=1'])
+            with InputWorkbook('ABC March 2024 Invoice.xlsx', folder=folder) as input_workbook:
+                self.assertTrue(read_excel_data(input_workbook, '(ABC00000.00)')['Time Period'].isna().all())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,173 @@
+import json
+import logging
+import os
+import queue
+import shutil
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+import unittest
+import openpyxl
+import main
+import utils.instrumentation as ins
+import utils.utils as ut
+from benchmarks.invoice_generator import generate_invoice
+
+# Seconds a fresh interpreter may take to import main, well above the usual time so slow machines don't fail it
+IMPORT_TIME_BUDGET = 1.0
+
+# Modules that should only load once a workbook is processed, xlwings only for the Excel template fallback
+HEAVY_MODULES = ['pandas', 'numpy', 'openpyxl', 'xlwings']
+
+STARTUP_SCRIPT = """
+import json, sys, time
+start_time = time.perf_counter()
+import main
+import_time = time.perf_counter() - start_time
+try:
+    main.parse_args(sys.argv[1:])
+except SystemExit:
+    pass
+print(json.dumps({'import_time': import_time, 'loaded': [name for name in %r if name in sys.modules]}))
+""" % HEAVY_MODULES
+
+
+def run_startup(*args):
+    # A fresh interpreter, the test process already has pandas loaded
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT, *args], cwd=root, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+class TestStartup(unittest.TestCase):
+
+    def test_import_time(self):
+        startup = run_startup()
+        self.assertEqual(startup['loaded'], [])
+        self.assertLess(startup['import_time'], IMPORT_TIME_BUDGET)
+
+    def test_help_and_bad_arguments(self):
+        self.assertEqual(run_startup('--help')['loaded'], [])
+        self.assertEqual(run_startup('--skip-formatting')['loaded'], [])
+
+
+class TestProcessWorkbook(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.input_folder = os.path.join(self.temp_dir.name, 'input')
+        self.output_folder = os.path.join(self.temp_dir.name, 'output')
+        os.makedirs(self.output_folder)
+        generate_invoice(os.path.join(self.input_folder, 'ABC March 2024 Invoice.xlsx'), charge_codes=2, rows_per_sheet=40, seed=1)
+        ins.reset()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_skip_formatting_keeps_outputs(self):
+        organized_path = os.path.join(self.output_folder, 'ABC March 2024 Organized Invoice.xlsx')
+        with open(organized_path, 'wb') as file:
+            file.write(b'earlier run')
+
+        main.process_workbook('ABC March 2024 Invoice.xlsx', use_cache=False, input_folder=self.input_folder, output_folder=self.output_folder,
+                              export_format='jsonl', skip_formatting=True)
+
+        # Only the data files are written, the organized invoice of an earlier run is left alone
+        with open(organized_path, 'rb') as file:
+            self.assertEqual(file.read(), b'earlier run')
+        self.assertTrue(os.path.exists(os.path.join(self.output_folder, 'ABC March 2024 Data', 'Summary.jsonl')))
+
+    def test_sheet_jobs_match_sequential(self):
+        generate_invoice(os.path.join(self.input_folder, 'DEF March 2024 Invoice.xlsx'), charge_codes=4, rows_per_sheet=60, seed=3)
+        workbooks = {}
+        for sheet_jobs in [1, 3]:
+            output_folder = os.path.join(self.output_folder, str(sheet_jobs))
+            os.makedirs(output_folder)
+            main.process_workbook('DEF March 2024 Invoice.xlsx', sheet_jobs, use_cache=False, input_folder=self.input_folder,
+                                  output_folder=output_folder)
+            workbooks[sheet_jobs] = openpyxl.load_workbook(os.path.join(output_folder, 'DEF March 2024 Organized Invoice.xlsx'))
+
+        # Sheets cleaned in parallel are written in the original order with the same contents
+        sequential, parallel = workbooks[1], workbooks[3]
+        self.assertEqual(parallel.sheetnames, sequential.sheetnames)
+        for sheet_name in sequential.sheetnames:
+            sequential_values = list(sequential[sheet_name].iter_rows(values_only=True))
+            self.assertEqual(list(parallel[sheet_name].iter_rows(values_only=True)), sequential_values, sheet_name)
+
+    def test_sheet_jobs_trace_memory(self):
+        ins.start_memory_tracing()
+        self.addCleanup(tracemalloc.stop)
+        main.process_workbook('ABC March 2024 Invoice.xlsx', 2, use_cache=False, input_folder=self.input_folder, output_folder=self.output_folder,
+                              export_format='jsonl', skip_formatting=True)
+
+        # The sheets cleaned in worker processes report the peak memory of their worker
+        clean_records = [record for record in ins.drain_records() if record['stage'] == 'clean_sheet_data']
+        self.assertEqual(len(clean_records), 2)
+        self.assertTrue(all(record['peak_memory_mb'] is not None for record in clean_records))
+
+    def test_init_sheet_worker_trace_memory(self):
+        # Workers that aren't forked start without tracing, the initializer turns it on
+        logger = logging.getLogger()
+        self.addCleanup(setattr, logger, 'handlers', logger.handlers[:])
+        self.addCleanup(logger.setLevel, logger.level)
+        self.addCleanup(tracemalloc.stop)
+        main.init_sheet_worker(queue.SimpleQueue(), logging.INFO, None, trace_memory=True)
+        self.assertTrue(tracemalloc.is_tracing())
+
+
+class TestParallelWorkbooks(unittest.TestCase):
+
+    def setUp(self):
+        # --jobs works on the input and output folders below the working directory
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.working_dir = os.getcwd()
+        os.makedirs(os.path.join(self.temp_dir.name, 'config'))
+        shutil.copy('config/sheet_template.xlsx', os.path.join(self.temp_dir.name, 'config'))
+        os.makedirs(os.path.join(self.temp_dir.name, 'output'))
+        generate_invoice(os.path.join(self.temp_dir.name, 'input', 'ABC March 2024 Invoice.xlsx'), charge_codes=2, rows_per_sheet=40, seed=1)
+        with open(os.path.join(self.temp_dir.name, 'input', 'XYZ March 2024 Invoice.xlsx'), 'wb') as file:
+            file.write(b'not a workbook')
+        os.chdir(self.temp_dir.name)
+        ins.reset()
+
+    def tearDown(self):
+        ut.stop_logger()
+        os.chdir(self.working_dir)
+        self.temp_dir.cleanup()
+
+    def test_failing_workbook(self):
+        exit_status = main.main(['--jobs', '2', '--no-cache'])
+        ut.stop_logger()
+
+        # The corrupt workbook fails the run without stopping the other one
+        self.assertEqual(exit_status, 1)
+        self.assertTrue(os.path.exists(os.path.join('output', 'ABC March 2024 Organized Invoice.xlsx')))
+
+        # Every worker's log is appended to logfile.log under its workbook
+        with open('logfile.log') as log_file:
+            log = log_file.read()
+        self.assertIn('----- ABC March 2024 Invoice.xlsx -----', log)
+        self.assertIn('----- XYZ March 2024 Invoice.xlsx -----', log)
+        self.assertIn('The current workbook is: ABC March 2024 Invoice.xlsx', log)
+        self.assertIn('Failed to process XYZ March 2024 Invoice.xlsx', log)
+
+    def test_failing_batch_workbook(self):
+        exit_status = main.main(['--batch', 'input', '--batch-output', 'batch_output', '--no-cache'])
+        ut.stop_logger()
+
+        # The corrupt workbook is recorded as failed in the manifest and fails the run
+        self.assertEqual(exit_status, 1)
+        self.assertTrue(os.path.exists(os.path.join('batch_output', 'ABC March 2024 Organized Invoice.xlsx')))
+        with open(os.path.join('batch_output', 'manifest.json')) as manifest_file:
+            jobs = json.load(manifest_file)['jobs']
+        self.assertEqual(jobs['XYZ March 2024 Invoice.xlsx']['state'], 'failed')
+
+    def test_exit_status(self):
+        os.remove(os.path.join('input', 'XYZ March 2024 Invoice.xlsx'))
+        generate_invoice(os.path.join('input', 'DEF March 2024 Invoice.xlsx'), charge_codes=1, rows_per_sheet=20, seed=2)
+        self.assertEqual(main.main(['--jobs', '2', '--no-cache']), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+import pandas as pd
+from utils.sheet_cache import code_version, sheet_key, load_sheet, store_sheet, prune_cache, cache_folder_path
+
+
+class TestSheetCache(unittest.TestCase):
+
+    def setUp(self):
+        self.import_df = pd.DataFrame({
+            'Name': ['Jane Doe'], 'Date': pd.Categorical(['03/01/2024']), 'Hours Worked': [8],
+            'Time Period': ['Time in: 08:00 - Time out: 16:00'], 'Charge Code': ['(ABC00001.00)']
+        })
+
+    def test_sheet_key(self):
+        changed_df = self.import_df.copy()
+        changed_df.loc[0, 'Hours Worked'] = 7
+
+        self.assertEqual(sheet_key(self.import_df), sheet_key(self.import_df.copy()))
+        self.assertNotEqual(sheet_key(self.import_df), sheet_key(changed_df))
+
+    def test_sheet_key_without_sources(self):
+        # The bundled executable can't read the sources, the cache version alone has to change the key
+        self.addCleanup(code_version.cache_clear)
+        with mock.patch('utils.sheet_cache.open', side_effect=OSError, create=True):
+            code_version.cache_clear()
+            key = sheet_key(self.import_df)
+            with mock.patch('config.settings.cache_version', -1):
+                code_version.cache_clear()
+                self.assertNotEqual(sheet_key(self.import_df), key)
+
+    def test_store_and_load_sheet(self):
+        with tempfile.TemporaryDirectory() as cache_folder:
+            key = sheet_key(self.import_df)
+            self.assertIsNone(load_sheet(key, cache_folder))
+
+            store_sheet(key, {'Summary': self.import_df}, cache_folder)
+            pd.testing.assert_frame_equal(load_sheet(key, cache_folder)['Summary'], self.import_df)
+
+    def test_prune_cache(self):
+        with tempfile.TemporaryDirectory() as cache_folder:
+            for name, days_unused in [('recent', 0), ('older', 1), ('stale', 40)]:
+                path = os.path.join(cache_folder, f'{name}.pkl')
+                with open(path, 'wb') as file:
+                    file.write(b'x' * 600 * 1024)
+                used_time = time.time() - days_unused * 24 * 60 * 60
+                os.utime(path, (used_time, used_time))
+
+            # The stale entry is past the age bound and the older one doesn't fit in 1 MB next to the recent one
+            prune_cache(cache_folder, max_age_days=30, max_megabytes=1)
+            self.assertEqual(os.listdir(cache_folder), ['recent.pkl'])
+
+    def test_cache_folder_path(self):
+        # The default folder belongs to the current user, not the working directory
+        with mock.patch('config.settings.cache_folder', None), mock.patch.dict(os.environ, {'LOCALAPPDATA': '/users/jane/AppData/Local'}):
+            self.assertEqual(cache_folder_path(), os.path.join('/users/jane/AppData/Local', 'PBGC_Billing_Automation', 'sheets'))
+        with mock.patch('config.settings.cache_folder', 'shared'):
+            self.assertEqual(cache_folder_path(), 'shared')
+
+
+if __name__ == '__main__':
+    unittest.main()
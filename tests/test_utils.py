@@ -0,0 +1,236 @@
+import datetime
+import importlib.util
+import io
+import logging
+import os
+import tempfile
+import unittest
+import openpyxl
+import pandas as pd
+from utils.utils import InputWorkbook, TimesheetFile, open_input_workbook, read_excel_data, clone_template_workbook, build_summary_block
+from utils.utils import LazyFrame, write_block, write_rows, set_logger, stop_logger
+from utils.clean_data import MismatchReconciler, clean_sheet_data
+
+
+class TestInputWorkbook(unittest.TestCase):
+
+    def setUp(self):
+        # Build a small invoice with a title above the headers and a total row below the data
+        self.temp_dir = tempfile.TemporaryDirectory()
+        workbook = openpyxl.Workbook()
+        worksheet = workbook.active
+        worksheet.title = '(ABC00001.00)'
+        worksheet.append(['Invoice Detail'])
+        worksheet.append([])
+        worksheet.append(['Name', 'ID', 'Date', 'Hours Worked', 'Time Period'])
+        worksheet.append(['Jane Doe', 1, datetime.datetime(2024, 3, 1), 8, 'Time in: 08:00 - Time out: 16:00'])
+        worksheet.append(['John Doe', 2, datetime.datetime(2024, 3, 2), 4.5, None])
+        worksheet.append([None, None, None, 12.5, 'Total'])
+        workbook.create_sheet('(PEN00000.00)')
+        workbook.create_sheet('Hidden').sheet_state = 'hidden'
+        workbook.create_sheet('Very Hidden').sheet_state = 'veryHidden'
+        workbook.save(os.path.join(self.temp_dir.name, 'ABC March 2024 Invoice.xlsx'))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_visible_sheet_names(self):
+        with InputWorkbook('ABC March 2024 Invoice.xlsx', folder=self.temp_dir.name) as input_workbook:
+            self.assertEqual(input_workbook.visible_sheet_names(), ['(ABC00001.00)'])
+
+    def test_read_excel_data(self):
+        with InputWorkbook('ABC March 2024 Invoice.xlsx', folder=self.temp_dir.name) as input_workbook:
+            df = read_excel_data(input_workbook, '(ABC00001.00)')
+
+        self.assertEqual(df.columns.tolist(), ['Name', 'Date', 'Hours Worked', 'Time Period', 'Charge Code'])
+        self.assertEqual(df['Date'].tolist(), ['03/01/2024', '03/02/2024'])
+        self.assertEqual(df['Hours Worked'].tolist(), [8, 4.5])
+        self.assertTrue(pd.isna(df.loc[1, 'Time Period']))
+
+    @unittest.skipUnless(importlib.util.find_spec('python_calamine'), 'python-calamine is not installed')
+    def test_calamine_matches_openpyxl(self):
+        with open_input_workbook('ABC March 2024 Invoice.xlsx', self.temp_dir.name, engine='calamine') as input_workbook:
+            self.assertEqual(input_workbook.visible_sheet_names(), ['(ABC00001.00)'])
+            calamine_states = input_workbook.sheet_states()
+            calamine_df = read_excel_data(input_workbook, '(ABC00001.00)')
+        with open_input_workbook('ABC March 2024 Invoice.xlsx', self.temp_dir.name, engine='openpyxl') as input_workbook:
+            openpyxl_states = input_workbook.sheet_states()
+            openpyxl_df = read_excel_data(input_workbook, '(ABC00001.00)')
+
+        self.assertEqual(calamine_states, openpyxl_states)
+        pd.testing.assert_frame_equal(calamine_df, openpyxl_df)
+
+
+class TestTimesheetFile(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        pd.DataFrame({
+            'Name': ['Jane Doe', 'John Doe', 'Jane Doe'],
+            'Date': ['2024-03-01', '2024-03-02', '2024-03-01'],
+            'Hours Worked': [8, 4.5, 2],
+            'Time Period': ['Time in: 08:00 - Time out: 16:00', None, 'Time in: 16:00 - Time out: 18:00'],
+            'Charge Code': ['(ABC00001.00)', '(ABC00001.00)', '(ABC00002.00)']
+        }).to_csv(os.path.join(self.temp_dir.name, 'ABC March 2024 Invoice.csv'), index=False)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_read_excel_data(self):
+        with open_input_workbook('ABC March 2024 Invoice.csv', self.temp_dir.name) as input_workbook:
+            self.assertIsInstance(input_workbook, TimesheetFile)
+            self.assertEqual(input_workbook.visible_sheet_names(), ['(ABC00001.00)', '(ABC00002.00)'])
+            df = read_excel_data(input_workbook, '(ABC00001.00)')
+
+        # Same frame as a charge code sheet of an invoice workbook
+        self.assertEqual(df.columns.tolist(), ['Name', 'Date', 'Hours Worked', 'Time Period', 'Charge Code'])
+        self.assertEqual(df['Date'].tolist(), ['03/01/2024', '03/02/2024'])
+        self.assertEqual(df['Hours Worked'].tolist(), [8, 4.5])
+        self.assertTrue(pd.isna(df.loc[1, 'Time Period']))
+
+    def test_date_order_across_year_boundary(self):
+        pd.DataFrame({
+            'Name': ['Jane Doe'] * 4,
+            'Date': ['2023-12-30', '2024-01-02', '2023-12-30', '2024-01-02'],
+            'Hours Worked': [9, 9, 9, 9],
+            'Time Period': ['Time in: 08:00 - Time out: 16:00'] * 4,
+            'Charge Code': ['(ABC00001.00)', '(ABC00001.00)', '(ABC00002.00)', '(ABC00002.00)']
+        }).to_csv(os.path.join(self.temp_dir.name, 'ABC January 2024 Invoice.csv'), index=False)
+
+        reconciler = MismatchReconciler()
+        with open_input_workbook('ABC January 2024 Invoice.csv', self.temp_dir.name) as input_workbook:
+            for sheet_name in input_workbook.visible_sheet_names():
+                summary_df = clean_sheet_data(read_excel_data(input_workbook, sheet_name))['Summary']
+                reconciler.add(summary_df)
+
+        # Dates sort like the MM/DD/YYYY strings, in the summary and in the mismatch rows of every charge code
+        self.assertEqual(summary_df['Date'].tolist(), ['01/02/2024', '12/30/2023'])
+        overbilled_df = reconciler.reconcile()
+        self.assertEqual(overbilled_df['Date'].tolist(), ['12/30/2023', '12/30/2023', '01/02/2024', '01/02/2024'])
+
+    def test_missing_columns(self):
+        pd.DataFrame({'Name': ['Jane Doe']}).to_csv(os.path.join(self.temp_dir.name, 'Bad.csv'), index=False)
+        with self.assertRaises(IndexError):
+            open_input_workbook('Bad.csv', self.temp_dir.name)
+
+
+class TestCloneTemplateWorkbook(unittest.TestCase):
+
+    def test_clone_template_workbook(self):
+        workbook = clone_template_workbook('config/sheet_template.xlsx', ['A', 'B'])
+
+        self.assertEqual(workbook.sheetnames, ['B_Summary', 'B_Detail', 'B_Problem', 'A_Problem', 'A_Detail', 'A_Summary', 'Mismatch'])
+        self.assertEqual(workbook['B_Summary']['B9'].value, 'Name')
+        self.assertEqual(sorted(map(str, workbook['B_Summary'].merged_cells.ranges)), sorted(map(str, workbook['A_Summary'].merged_cells.ranges)))
+        self.assertEqual(workbook['B_Summary'].column_dimensions['E'].width, workbook['A_Summary'].column_dimensions['E'].width)
+
+
+class TestBuildSummaryBlock(unittest.TestCase):
+
+    def test_build_summary_block(self):
+        summary_df = pd.DataFrame({
+            'Name': ['Jane Doe', 'Jane Doe', 'John Doe'],
+            'Date': ['03/01/2024', '03/02/2024', '03/01/2024'],
+            'Total Hours Worked': [8, 4.5, 2],
+            'Formatted Time Comments': ['08:00-16:00', '08:00-12:30', '09:00-11:00'],
+            'Subtotal': [12.5, 12.5, 2]
+        })
+        block = build_summary_block(summary_df)
+
+        # A subtotal row follows every run of names
+        self.assertEqual(block['Name'].tolist(), ['Jane Doe', 'Jane Doe', 'Jane Doe', 'John Doe', 'John Doe'])
+        self.assertEqual(block['Subtotal Row'].tolist(), [False, False, True, False, True])
+        self.assertEqual(block.loc[2, 'Formatted Time Comments'], 'Subtotal: 12.5 Hours')
+        self.assertEqual(block.loc[4, 'Formatted Time Comments'], 'Subtotal: 2.0 Hours')
+        self.assertTrue(pd.isna(block.loc[2, 'Date']))
+
+
+def saved_sheet(worksheet):
+    # The sheet as read back after saving its workbook
+    buffer = io.BytesIO()
+    worksheet.parent.save(buffer)
+    return openpyxl.load_workbook(buffer).active
+
+
+class TestWriteBlock(unittest.TestCase):
+
+    def setUp(self):
+        self.worksheet = openpyxl.Workbook().active
+
+    def test_write_block(self):
+        df = pd.DataFrame({'Name': ['Jane Doe', '=1+1'], 'Hours': [8.5, None], 'Empty': [True, False]})
+        write_block(self.worksheet, df, {'row': 4, 'col': 2})
+
+        self.assertEqual([cell.value for cell in self.worksheet[3][1:4]], ['Name', 'Hours', 'Empty'])
+        self.assertEqual([cell.value for cell in self.worksheet[4][1:4]], ['Jane Doe', 8.5, True])
+        self.assertEqual([cell.data_type for cell in self.worksheet[4][1:4]], ['s', 'n', 'b'])
+
+        # Missing values are empty cells and formulas are still recognized
+        self.assertIsNone(self.worksheet['C5'].value)
+        self.assertEqual(self.worksheet['B5'].data_type, 'f')
+
+    def test_write_block_skip_empty(self):
+        df = pd.DataFrame({'Name': ['Jane Doe', 'Jane Doe'], 'Date': ['03/01/2024', None]})
+        write_block(self.worksheet, df, {'row': 1, 'col': 1}, header=False, skip_empty=[False, True])
+
+        # Empty values of skipped rows don't create cells
+        self.assertIn((1, 2), self.worksheet._cells)
+        self.assertNotIn((2, 2), self.worksheet._cells)
+
+    def test_write_rows_matches_value_setter(self):
+        values = ['Jane Doe', '', 8, 8.5, True, None, datetime.datetime(2024, 3, 1), pd.Timestamp('2024-03-01 08:00'), '=1+1', '#N/A',
+                  'x' * 40000]
+        write_rows(self.worksheet, [values], 1, 1)
+        reference_sheet = openpyxl.Workbook().active
+        for column, value in enumerate(values, start=1):
+            reference_sheet.cell(row=1, column=column, value=value)
+
+        # The cells bound directly must match what openpyxl's own setter stores, before and after a save, so an openpyxl release
+        # that changes its cell internals fails here
+        for worksheet, reference in [(self.worksheet, reference_sheet), (saved_sheet(self.worksheet), saved_sheet(reference_sheet))]:
+            for cell, reference_cell in zip(worksheet[1], reference[1]):
+                self.assertEqual((cell.value, cell.data_type, cell.number_format),
+                                 (reference_cell.value, reference_cell.data_type, reference_cell.number_format))
+
+    def test_write_block_illegal_character(self):
+        with self.assertRaises(openpyxl.utils.exceptions.IllegalCharacterError):
+            write_block(self.worksheet, pd.DataFrame({'Name': ['Jane\x01Doe']}), {'row': 2, 'col': 1})
+
+
+class TestLogger(unittest.TestCase):
+
+    def setUp(self):
+        # set_logger replaces the root logger's handlers, they are put back after the test
+        logger = logging.getLogger()
+        self.addCleanup(setattr, logger, 'handlers', logger.handlers[:])
+        self.addCleanup(logger.setLevel, logger.level)
+
+    def test_message_rendered_when_logged(self):
+        with tempfile.TemporaryDirectory() as folder:
+            log_filename = os.path.join(folder, 'logfile.log')
+            set_logger(log_filename, console=False, level='DEBUG')
+            try:
+                hours = [8]
+                logging.info('Hours %s', hours)
+                hours.append(4)
+            finally:
+                stop_logger()
+
+            # The record shows the arguments as they were when it was logged, not when the listener wrote it
+            with open(log_filename) as log_file:
+                self.assertIn('Hours [8]\n', log_file.read())
+
+
+class TestLazyFrame(unittest.TestCase):
+
+    def test_lazy_frame(self):
+        df = pd.DataFrame({'Name': [f'Person {i}' for i in range(100)]})
+
+        # Only the first and last rows are rendered
+        self.assertIn('Person 0', str(LazyFrame(df, max_rows=4)))
+        self.assertNotIn('Person 50', str(LazyFrame(df, max_rows=4)))
+        self.assertIn('Person 50', str(LazyFrame(df, max_rows=0)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import os
+import tempfile
+import unittest
+from utils.watch_folder import WorkbookWatcher
+
+
+class TestWorkbookWatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.watcher = WorkbookWatcher(self.temp_dir.name, settle_seconds=0, use_events=False)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write(self, filename, content=b'workbook'):
+        with open(os.path.join(self.temp_dir.name, filename), 'wb') as file:
+            file.write(content)
+
+    def test_scan(self):
+        self.write('ABC March 2024 Invoice.xlsx')
+        self.write('notes.txt')
+
+        # A workbook is handed out once after it has been seen unchanged
+        self.assertEqual(self.watcher.scan(), [])
+        self.assertEqual(self.watcher.scan(), ['ABC March 2024 Invoice.xlsx'])
+        self.assertEqual(self.watcher.scan(), [])
+
+        # Modifying the workbook queues it again
+        self.write('ABC March 2024 Invoice.xlsx', b'modified workbook')
+        self.assertEqual(self.watcher.scan(), [])
+        self.assertEqual(self.watcher.scan(), ['ABC March 2024 Invoice.xlsx'])
+
+    def test_scan_skips_open_workbooks(self):
+        self.write('ABC March 2024 Invoice.xlsx')
+        self.write('~$ABC March 2024 Invoice.xlsx')
+        self.watcher.scan()
+        self.assertEqual(self.watcher.scan(), [])
+
+        os.remove(os.path.join(self.temp_dir.name, '~$ABC March 2024 Invoice.xlsx'))
+        self.assertEqual(self.watcher.scan(), ['ABC March 2024 Invoice.xlsx'])
+
+
+if __name__ == '__main__':
+    unittest.main()
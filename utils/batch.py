@@ -0,0 +1,88 @@
+import json
+import logging
+import os
+import tempfile
+import time
+from config.settings import input_extensions
+
+
+def find_workbook_tree(root, exclude_folder=None) -> list[str]:
+    """
+    Relative paths of every invoice workbook or timesheet below root, skipping "~" lock files like find_workbook_list
+    """
+    relative_paths = []
+    for folder_path, folder_names, filenames in os.walk(root):
+        # Don't pick up organized invoices when the output folder is inside the batch tree
+        if exclude_folder is not None:
+            folder_names[:] = [name for name in folder_names if os.path.abspath(os.path.join(folder_path, name)) != os.path.abspath(exclude_folder)]
+        for filename in filenames:
+            if not filename.startswith('~') and os.path.splitext(filename)[1].lower() in input_extensions:
+                relative_paths.append(os.path.relpath(os.path.join(folder_path, filename), root).replace(os.sep, '/'))
+    return sorted(relative_paths)
+
+
+class BatchManifest():
+    """
+    State of every workbook in a batch run, written to disk after each change so an interrupted run can resume
+    """
+    def __init__(self, path) -> None:
+        self.path = path
+        try:
+            with open(path, encoding='utf-8') as file:
+                self.jobs = json.load(file)['jobs']
+        except FileNotFoundError:
+            self.jobs = {}
+
+    def sync(self, root, relative_paths):
+        """
+        Add new workbooks as pending, a finished workbook is queued again when its file has changed
+        """
+        jobs = {}
+        for relative_path in relative_paths:
+            stat = os.stat(os.path.join(root, relative_path))
+            signature = [stat.st_size, stat.st_mtime_ns]
+
+            job = self.jobs.get(relative_path)
+            if job is None or job['signature'] != signature:
+                job = {'state': 'pending', 'signature': signature}
+            jobs[relative_path] = job
+
+        self.jobs = jobs
+        self.save()
+
+    def unfinished(self) -> list[str]:
+        # Pending, failed and jobs left running by an interrupted run are all picked up again
+        return [relative_path for relative_path, job in self.jobs.items() if job['state'] != 'done']
+
+    def failed(self) -> list[str]:
+        return [relative_path for relative_path, job in self.jobs.items() if job['state'] == 'failed']
+
+    def counts(self) -> dict[str, int]:
+        counts = {}
+        for job in self.jobs.values():
+            counts[job['state']] = counts.get(job['state'], 0) + 1
+        return counts
+
+    def start(self, relative_path):
+        job = self.jobs[relative_path]
+        job.update(state='running', started=time.strftime('%Y-%m-%d %H:%M:%S'))
+        job.pop('error', None)
+        self.save()
+
+    def finish(self, relative_path, seconds, error=None):
+        job = self.jobs[relative_path]
+        job.update(state='done' if error is None else 'failed', seconds=round(seconds, 3), finished=time.strftime('%Y-%m-%d %H:%M:%S'))
+        if error is not None:
+            job['error'] = str(error)
+        self.save()
+
+    def save(self):
+        folder = os.path.dirname(self.path) or '.'
+        os.makedirs(folder, exist_ok=True)
+
+        # Replace the manifest in one step so a crash never leaves it half written
+        file_descriptor, temp_path = tempfile.mkstemp(dir=folder, suffix='.tmp')
+        with os.fdopen(file_descriptor, 'w', encoding='utf-8') as file:
+            json.dump({'jobs': self.jobs}, file, indent=2)
+        os.replace(temp_path, self.path)
+        logging.debug(f'Saved batch manifest {self.path}')
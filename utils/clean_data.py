@@ -1,59 +1,58 @@
-import re
+import numpy as np
 import pandas as pd
 import logging
-from datetime import datetime, date, timedelta
+from datetime import datetime, timedelta
 import utils.utils as ut
 import utils.format_excel as fe
-import openpyxl
+import utils.time_parsing as tp
+import utils.instrumentation as ins
 from config.settings import overbilled_loc
 
 
 def calculate_total_time_difference(in_times, out_times):
-    # Initialize a variable to hold the sum of the differences
-    total_hours = 0
+    # Parse the time strings to minutes past midnight
+    in_minutes = tp.times_to_minutes(list(in_times))
+    out_minutes = tp.times_to_minutes(list(out_times))
+    if (in_minutes == tp.INVALID_MINUTES).any() or (out_minutes == tp.INVALID_MINUTES).any():
+        raise ValueError(f'Unable to parse time in: {in_times} or time out: {out_times}')
 
-    # Iterate over the paired in and out times
-    for in_time, out_time in zip(in_times, out_times):
-
-        # Parse the time strings to datetime.time objects
-        in_time = pd.to_datetime(in_time, format='%H:%M').time()
-        out_time = pd.to_datetime(out_time, format='%H:%M').time()
-
-        # Calculate the difference in hours
-        difference = (datetime.combine(date.min, out_time) - datetime.combine(date.min, in_time)).total_seconds() / 3600
-
-        # Add the difference to the total
-        total_hours += difference
-
-    # Round to the nearest 0.25
-    total_hours = round(total_hours * 4) / 4
-    return total_hours
+    # Sum the differences and round to the nearest 0.25
+    rows = np.zeros(len(in_minutes), dtype=np.intp)
+    total_hours = tp.sum_time_worked(rows, in_minutes, out_minutes, 1)[0]
+    return float(total_hours)
 
 
 class CleanData():
     def __init__(self, df: pd.DataFrame) -> None:
         self.df = df
-
+        # Parsed comments and one row per time pair of each comment, filled by extract_times
+        self.parsed_comments = None
+        self.time_pairs = None
+
+    def current_time_pairs(self) -> tuple[pd.DataFrame, np.ndarray]:
+        """
+        Drop the pairs of comments taken out by the previous steps, returns the pairs and the position of their row in self.df
+        """
+        self.time_pairs, rows = tp.pair_positions(self.time_pairs, self.df.index)
+        return self.time_pairs, rows
+
+    @ins.timed_method
     def calculate_ts(self):
-        def get_week_start_end_dates(date_str: str, date_format: str = "%m/%d/%Y") -> str:
-            # Parse the date string into a datetime object
-            given_date = datetime.strptime(date_str, date_format)
-
-            # Adjust the start of the week to Sunday
-            start_of_week = given_date - timedelta(days=(given_date.weekday() + 1) % 7)
+        # Every distinct date is parsed once, the rows share the week range of their date
+        dates = self.df['Date'].astype('category')
+        given_dates = pd.to_datetime(dates.cat.categories, format='%m/%d/%Y')
 
-            # Calculate the end of the week as Saturday
-            end_of_week = start_of_week + timedelta(days=6)
+        # Adjust the start of the week to Sunday and end the week on Saturday
+        start_of_week = given_dates - pd.to_timedelta((given_dates.dayofweek + 1) % 7, unit='D')
+        end_of_week = start_of_week + pd.Timedelta(days=6)
 
-            # Return the start and end of the week as a formatted string range
-            ts_range = f'{start_of_week.strftime(date_format)} - {end_of_week.strftime(date_format)}'
-            return ts_range
-
-        # Apply the function to the 'Date' column of the dataframe
-        self.df['T/S'] = self.df['Date'].apply(get_week_start_end_dates)
+        # Format the start and end of the week as a string range and map it back to the rows
+        ts_ranges = start_of_week.strftime('%m/%d/%Y') + ' - ' + end_of_week.strftime('%m/%d/%Y')
+        self.df['T/S'] = dates.map(dict(zip(dates.cat.categories, ts_ranges))).astype('category')
         logging.info('Calculated T/S periods')
-        logging.debug(self.df['T/S'])
+        logging.debug('%s', ut.LazyFrame(self.df['T/S']))
 
+    @ins.timed_method
     def find_empty_comments(self) -> pd.DataFrame:
         # Find empty comments
         self.df["Empty Comment"] = self.df['Time Period'].isna() | (self.df['Time Period'] == "")
@@ -67,68 +66,15 @@ class CleanData():
         self.df = self.df.drop('Empty Comment', axis=1)
         return empty_comment_df
 
+    @ins.timed_method
     def extract_times(self) -> pd.DataFrame:
         if self.df.empty:
             return self.df
 
-        def process_time_entries(row):
-            """
-            Takes in a row of time comments and extracts in times and outimes and issues
-            """
-
-            def extract_time_pairs(text: str):
-                """
-                Find time in and time out from comment
-                """
-                # Replace "24:00" with "23:59" for consistency
-                logging.debug(f'The current comment is:\n{text}')
-
-                # This pattern looks for pairs of times
-                pattern = r"(?:time in:?\s*(\d{1,2}:\d{2}))\s*[-,\u2013]?\s*(?:time out:?\s*(\d{1,2}:\d{2}))"
-                time_pairs = re.findall(pattern, text, re.I)
-
-                # Extract lists of in times and out times
-                in_times = [in_time for in_time, _ in time_pairs]
-                out_times = [out_time for _, out_time in time_pairs]
-
-                # Special handling for midnight formats
-                out_times = ["23:59" if time == "00:00" or time == "24:00" or time == "0:00" else time for time in out_times]
-
-                # Match "00:00" or "0:00" as pairs explicitly
-                zero_time_pattern = r"\b\d{1,2}:\d{2}\b"
-                zero_time_matches = re.findall(zero_time_pattern, text)
-
-                # Assume that "00:00" or "0:00" must occur in pairs for in and out times
-                zero_time_pair_count = len(zero_time_matches)
-                logging.debug(f'There are currently {len(in_times)} in times and {zero_time_pair_count} pair(s) of zero digit times')
-
-                # Check for format issues
-                format_issue = len(in_times) != len(out_times) or len(time_pairs) * 2 != len(zero_time_matches)
-                return in_times, out_times, format_issue
-
-            # Convert to string to handle NaN or other non-string types gracefully
-            time_text = str(row['Time Period'])
-            intimes, outtimes, format_issue = extract_time_pairs(time_text)
-
-            # Check if any time entry doesn't match the 15-minute intervals
-            valid_endings = ["00", "15", "30", "45", "59"]
-            for time_entry in intimes + outtimes:
-                if time_entry[-2:] not in valid_endings:
-                    format_issue = True
-                    break
-
-            # Check if there are any 'in times' without corresponding 'out times' and vice versa
-            if not format_issue and len(intimes) != len(outtimes):
-                format_issue = True
-
-            # Check if the lists are empty which also indicates a format issue
-            elif not format_issue and not intimes and not outtimes:
-                format_issue = True
-
-            return pd.Series([intimes, outtimes, format_issue], index=['In Times', 'Out Times', 'Format Issue'])
-
-        # Apply proces time entry function to dataframe
-        self.df[['In Times', 'Out Times', 'Format Issue']] = self.df.apply(process_time_entries, axis=1)
+        # Parse every comment column-wise
+        self.parsed_comments, self.time_pairs = tp.parse_time_comments(self.df['Time Period'])
+        self.df['Format Issue'] = self.parsed_comments['Format Issue']
+        logging.info(f'Comment parse cache: {tp.comment_cache_stats()}')
 
         # Create format issue dataframe
         format_issue_df = self.df.loc[self.df['Format Issue'], ['Name', 'T/S', 'Date', 'Format Issue', 'Time Period']]
@@ -139,36 +85,15 @@ class CleanData():
         self.df.drop('Format Issue', axis=1, inplace=True)
         return format_issue_df
 
+    @ins.timed_method
     def check_military_time_format(self):
         if self.df.empty:
             return self.df
 
-        def check_military_time(in_times, out_times) -> bool:
-            """
-            Check if the time in time out order makes sense
-            """
-            military_time_issue = False
-
-            for in_time, out_time in zip(in_times, out_times):
-                try:
-                    # Parse the time strings to datetime.time objects
-                    in_time_obj = pd.to_datetime(in_time, format='%H:%M').time()
-                    out_time_obj = pd.to_datetime(out_time, format='%H:%M').time()
-
-                    # Check if out time is before in time
-                    if out_time_obj <= in_time_obj:
-                        military_time_issue = True
-                        logging.debug(f"in time: {in_time_obj}, out time: {out_time_obj}, military issue: {military_time_issue}")
-
-                except Exception as e:
-                    military_time_issue = True
-                    logging.debug(f'There is a military time issue. Exception: {e}')
-                    return military_time_issue
-
-            return military_time_issue
-
-        # apply check military time function to dataframe
-        self.df['Military Time Issue'] = self.df.apply(lambda row: check_military_time(row['In Times'], row['Out Times']), axis=1)
+        # Check if the time in time out order makes sense for every pair at once
+        time_pairs, rows = self.current_time_pairs()
+        self.df['Military Time Issue'] = tp.find_military_time_issues(rows, time_pairs['In Minutes'].to_numpy(), time_pairs['Out Minutes'].to_numpy(),
+                                                                      len(self.df.index))
 
         # Find military time issues
         military_time_issue_df = self.df.loc[self.df['Military Time Issue'], ['Name', 'T/S', 'Date', 'Military Time Issue', 'Time Period']]
@@ -179,70 +104,33 @@ class CleanData():
         self.df.drop('Military Time Issue', axis=1, inplace=True)
         return military_time_issue_df
 
+    @ins.timed_method
     def calculate_time_worked(self) -> pd.DataFrame:
         if self.df.empty:
             return self.df, self.df
 
-        def format_time_pair(in_times, out_times):
-            formatted_times = []
-
-            for index, (in_time, out_time) in enumerate(zip(in_times, out_times)):
-                # Parse the time strings to datetime objects
-                in_datetime = pd.to_datetime(in_time, format='%H:%M')
-                out_datetime = pd.to_datetime(out_time, format='%H:%M')
-
-                # Format the datetime objects to 'HH:MM' format
-                formatted_in_time = in_datetime.strftime('%H:%M')
-                formatted_out_time = out_datetime.strftime('%H:%M')
-
-                # Check if the out time is 23:59 and replace it with '00:00' of the next day, generally considered as '24:00'
-                if formatted_out_time == '23:59':
-                    formatted_out_time = '00:00'
-
-                # Append the formatted time pair to the list
-                formatted_pair = f"Time in: {formatted_in_time} - Time out: {formatted_out_time}"
-                if (index + 1) % 2 == 0 and index < len(in_times) - 1:  # Add newline after each pair except the last
-                    formatted_pair += "\n"
-                elif index < len(in_times) - 1:  # Add semicolon only if it's not the last pair
-                    formatted_pair += "; "
-
-                formatted_times.append(formatted_pair)
-
-            # Join the formatted time pairs without any additional character, as the semicolon and newline are already added
-            return "".join(formatted_times)
-
-        # Apply the function to each row and assign the result to a new column 'Commented Time Worked'
-        self.df['Commented Time Worked'] = self.df.apply(lambda row: calculate_total_time_difference(row['In Times'], row['Out Times']), axis=1)
-        self.df['Formatted Time Comments'] = self.df.apply(lambda row: format_time_pair(row['In Times'], row['Out Times']), axis=1)
+        # The commented time worked and the formatted comment for each row were worked out when the comment was parsed
+        self.df['Commented Time Worked'] = self.parsed_comments['Commented Time Worked']
+        self.df['Formatted Time Comments'] = self.parsed_comments['Formatted Time Comments']
 
         # Calculate time charged
-        self.df['Total Hours Worked'] = self.df.groupby(['Name', 'Date'])['Hours Worked'].transform('sum')
-
-        # Calcaulate where
-        # Convert 'In Times' and 'Out Times' to string for comparison purposes
-        self.df['In Times Str'] = self.df['In Times'].apply(lambda x: ';'.join(map(str, x)))
-        self.df['Out Times Str'] = self.df['Out Times'].apply(lambda x: ';'.join(map(str, x)))
+        self.df['Total Hours Worked'] = self.df.groupby(['Name', 'Date'], observed=True)['Hours Worked'].transform('sum')
 
-        # Calculate unique 'In Times' and 'Out Times' for each group
-        self.df['Unique In Times'] = self.df.groupby(['Name', 'Date'])['In Times Str'].transform('nunique')
-        self.df['Unique Out Times'] = self.df.groupby(['Name', 'Date'])['Out Times Str'].transform('nunique')
-
-        # Determine if there's is a conflicting time in and time out for the same date
-        self.df['Conflicting Comment'] = ""
-        self.df['Conflicting Comment'] = (self.df['Unique In Times'] > 1) | (self.df['Unique Out Times'] > 1)
+        # Determine if there's is a conflicting time in and time out for the same date, rows without a name or date are never grouped
+        time_pairs, rows = self.current_time_pairs()
+        groups = self.df.groupby(['Name', 'Date'], observed=True, sort=False).ngroup().fillna(-1).to_numpy(dtype=np.intp)
+        self.df['Conflicting Comment'] = tp.find_conflicting_pairs(groups, rows, time_pairs)
         conflicting_comment_df = self.df.loc[self.df['Conflicting Comment'], ['Name', 'T/S', 'Date', 'Conflicting Comment', 'Time Period']]
         logging.info(f'There are {len(conflicting_comment_df.index)} conflicting time comments')
         self.df = self.df.loc[~self.df['Conflicting Comment']]
         self.df.drop('Conflicting Comment', axis=1, inplace=True)
 
-        # Clean up temporary columns
-        self.df.drop(['In Times Str', 'Out Times Str', 'Unique In Times', 'Unique Out Times'], axis=1, inplace=True)
-
         # Create acceptable comment df
         acceptable_df = self.df[['Name', 'T/S', 'Date', 'Time Period', 'Formatted Time Comments']]
         logging.info(f'There are {len(acceptable_df.index)} acceptable time comments')
         return conflicting_comment_df, acceptable_df
 
+    @ins.timed_method
     def clean_summary_df(self):
         self.df.drop_duplicates(subset=["Name", "Date", "Formatted Time Comments"], ignore_index=True, inplace=True)
         self.df.sort_values(by=['Name', 'Date'], inplace=True)
@@ -250,39 +138,85 @@ class CleanData():
 
         self.df['Subtotal'] = ''
         self.df['Subtotal'] = self.df.groupby(['Name'])['Total Hours Worked'].transform('sum')
-        logging.debug(self.df.to_string())
+        logging.debug('Summary rows:\n%s', ut.LazyFrame(self.df))
         return self.df
 
 
-def calc_total_billed_n_comment(invoice_sheet_name: str, invoice_sheet_names: list, dataframes: dict[str, pd.DataFrame], workbook_filename: str) -> pd.DataFrame:
-    summary_df = dataframes['Summary']
-    workbook_df = dataframes['Mismatch']
+def clean_sheet_data(import_df: pd.DataFrame) -> dict[str, pd.DataFrame]:
+    """
+    Run the cleaning steps for one charge code sheet, this doesn't depend on any other sheet
+    """
+    # Intialize class for cleaning data
+    clean_df = CleanData(import_df)
+
+    # Calculate T/S
+    clean_df.calculate_ts()
 
-    # Concat charge code sheet data
-    if invoice_sheet_name == invoice_sheet_names[0]:
-        workbook_df = summary_df
-        return workbook_df
+    # find empty comment
+    empty_comments_df = clean_df.find_empty_comments()
 
-    if invoice_sheet_name != invoice_sheet_names[-1]:
-        workbook_df = pd.concat([workbook_df, summary_df], ignore_index=True)
-        return workbook_df
+    # Extract times from comment
+    format_issue_df = clean_df.extract_times()
 
-    # Add the summed hours back to the original DataFrame
-    workbook_df['Daily Total Hours Worked'] = workbook_df.groupby(['Name', 'Date'])['Hours Worked'].transform('sum')
-    workbook_df['Daily Commented Time Worked'] = workbook_df.groupby(['Name', 'Date'])['Commented Time Worked'].transform('sum')
+    # Check for military time format
+    military_time_issue_df = clean_df.check_military_time_format()
 
-    # Add a column to flag conflicts in reported time
-    workbook_df['Conflicting Time Worked'] = workbook_df['Daily Total Hours Worked'] > workbook_df['Daily Commented Time Worked']
+    # Calculate time worked
+    differing_time_df, acceptable_df = clean_df.calculate_time_worked()
 
-    # Save the subset with conflicts to another CSV
-    subset_columns = ['Name', 'T/S', 'Date', 'Charge Code', 'Conflicting Time Worked', 'Time Period', 'Total Hours Worked',
-                      'Commented Time Worked', 'Daily Total Hours Worked', 'Daily Commented Time Worked']
-    overbilled_df = workbook_df.loc[workbook_df['Conflicting Time Worked'], subset_columns]
-    overbilled_df.sort_values(['Name', 'Date'], ascending=[True, False], inplace=True)
-    logging.info(f'There are {len(overbilled_df.index)} mismatched time comments')
+    # Clean and calcualte subtotals for summar sheet
+    clean_df.clean_summary_df()
 
+    # Organize dataframes
+    return {
+        "Empty": empty_comments_df,
+        "Format": format_issue_df,
+        "Military": military_time_issue_df,
+        "ConflictingTime": differing_time_df,
+        "Acceptable": acceptable_df,
+        "Summary": clean_df.df
+    }
+
+
+class MismatchReconciler():
+    """
+    Collects the summary of every charge code sheet and compares billed and commented hours across all of them
+    """
+    def __init__(self) -> None:
+        self.summary_dfs = []
+
+    def add(self, summary_df: pd.DataFrame):
+        # Keep a reference only, everything is concatenated once in reconcile
+        if not summary_df.empty:
+            self.summary_dfs.append(summary_df)
+
+    def reconcile(self) -> pd.DataFrame:
+        subset_columns = ['Name', 'T/S', 'Date', 'Charge Code', 'Conflicting Time Worked', 'Time Period', 'Total Hours Worked',
+                          'Commented Time Worked', 'Daily Total Hours Worked', 'Daily Commented Time Worked']
+        if not self.summary_dfs:
+            return pd.DataFrame(columns=subset_columns)
+
+        # Concat charge code sheet data
+        workbook_df = pd.concat(self.summary_dfs, ignore_index=True)
+
+        # Add the daily hours summed over every charge code back to each row
+        daily_totals = workbook_df.groupby(['Name', 'Date'], observed=True)[['Hours Worked', 'Commented Time Worked']].transform('sum')
+        workbook_df['Daily Total Hours Worked'] = daily_totals['Hours Worked']
+        workbook_df['Daily Commented Time Worked'] = daily_totals['Commented Time Worked']
+
+        # Add a column to flag conflicts in reported time
+        workbook_df['Conflicting Time Worked'] = workbook_df['Daily Total Hours Worked'] > workbook_df['Daily Commented Time Worked']
+
+        # Keep the conflicting rows
+        overbilled_df = workbook_df.loc[workbook_df['Conflicting Time Worked'], subset_columns]
+        overbilled_df = overbilled_df.sort_values(['Name', 'Date'], ascending=[True, False])
+        logging.info(f'There are {len(overbilled_df.index)} mismatched time comments')
+        return overbilled_df
+
+
+def create_mismatch_sheet(overbilled_df: pd.DataFrame, output_workbook: ut.OutputWorkbook):
     # Create overbilled sheet
-    workbook = openpyxl.load_workbook(workbook_filename)
+    workbook = output_workbook.workbook
     worksheet = workbook['Mismatch']
     template_sheet = 'Mismatch'
     locations = overbilled_loc
@@ -292,11 +226,5 @@ def calc_total_billed_n_comment(invoice_sheet_name: str, invoice_sheet_names: li
 
     # if there are values format the workbook then move it first
     if not empty_df:
-        fe.format_sheet(workbook, workbook_filename, worksheet, template_sheet, locations, dataframes)
+        fe.format_sheet(worksheet, template_sheet, locations, {'Mismatch': overbilled_df})
         workbook.move_sheet(worksheet, -len(workbook.sheetnames))
-        workbook.save(workbook_filename)
-
-    # Save and close workbook
-    workbook.save(workbook_filename)
-    workbook.close()
-    return overbilled_df
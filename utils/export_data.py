@@ -0,0 +1,75 @@
+import importlib.util
+import logging
+import os
+import pandas as pd
+from config.settings import export_formats
+
+# Tables written for every workbook, the issue and summary frames of each charge code plus the workbook wide mismatch frame
+EXPORT_TABLES = ['Empty', 'Format', 'Military', 'ConflictingTime', 'Acceptable', 'Summary', 'Mismatch']
+
+
+def check_export_format(export_format):
+    """
+    Fail before any work is done when the format is unknown or its optional engine isn't installed
+    """
+    if export_format not in export_formats:
+        raise ValueError(f'Unknown export format {export_format}, expected one of {list(export_formats)}')
+    if export_format == 'parquet' and not any(importlib.util.find_spec(engine) for engine in ['pyarrow', 'fastparquet']):
+        raise ImportError('Parquet export needs the pyarrow or fastparquet package, install one or export as csv or jsonl')
+
+
+def export_folder_path(filename, output_folder='output') -> str:
+    # Named like the organized invoice, one file per table inside
+    destination_filename = os.path.basename(filename).split(" Invoice")[0]
+    return os.path.join(output_folder, f'{destination_filename} Data')
+
+
+class DataExporter():
+    """
+    Collects the cleaned frames of every charge code sheet of a workbook and writes one file per table, each record tagged with its
+    workbook and charge code
+    """
+    def __init__(self, invoice_filename, export_format, output_folder='output') -> None:
+        check_export_format(export_format)
+        self.invoice_filename = invoice_filename
+        self.export_format = export_format
+        self.folder = export_folder_path(invoice_filename, output_folder)
+        self.tables = {table: [] for table in EXPORT_TABLES}
+
+    def tag(self, df, invoice_sheet_name=None) -> pd.DataFrame:
+        # Mismatch rows already carry the charge code of their summary row
+        df = df.drop(columns=['index', 'Charge Code'] if invoice_sheet_name is not None else ['index'], errors='ignore')
+        tags = {'Workbook': os.path.basename(self.invoice_filename)}
+        if invoice_sheet_name is not None:
+            tags['Charge Code'] = invoice_sheet_name
+        return df.assign(**tags)[list(tags) + list(df.columns)]
+
+    def add(self, invoice_sheet_name, dataframes: dict[str, pd.DataFrame]):
+        for table, df in dataframes.items():
+            self.tables[table].append(self.tag(df, invoice_sheet_name))
+
+    def add_mismatch(self, overbilled_df: pd.DataFrame):
+        self.tables['Mismatch'].append(self.tag(overbilled_df))
+
+    def write(self) -> list[str]:
+        """
+        Write every table, tables without rows are still written so importers always find the same files
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        paths = []
+        for table, dfs in self.tables.items():
+            df = pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame(columns=['Workbook', 'Charge Code'])
+            path = os.path.join(self.folder, table + export_formats[self.export_format])
+            write_table(df, path, self.export_format)
+            paths.append(path)
+        logging.info(f'Exported {len(paths)} tables to {self.folder}')
+        return paths
+
+
+def write_table(df: pd.DataFrame, path, export_format):
+    if export_format == 'parquet':
+        df.to_parquet(path, index=False)
+    elif export_format == 'csv':
+        df.to_csv(path, index=False)
+    else:
+        df.to_json(path, orient='records', lines=True, date_format='iso', force_ascii=False)
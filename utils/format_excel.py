@@ -1,9 +1,15 @@
 import openpyxl
 import logging
+import pandas as pd
+import utils.utils as ut
 from openpyxl.styles import PatternFill, Border, Side
 from openpyxl.styles import Alignment
 from config.settings import template_sheets, summary_loc, problem_loc, detail_loc, overbilled_loc  # noqa
 from openpyxl.utils import get_column_letter
+from openpyxl.formatting.rule import FormulaRule
+from openpyxl.styles.cell_style import StyleArray
+from copy import copy
+import weakref
 
 
 def combine_borders(original_border, new_border):
@@ -29,6 +35,74 @@ def combine_borders(original_border, new_border):
     return combined
 
 
+# Style slots of a cell and the workbook collection their ids point into
+STYLE_COLLECTIONS = {'borderId': '_borders', 'alignmentId': '_alignments', 'fillId': '_fills'}
+
+
+def replace_style(current_style, new_style):
+    return new_style
+
+
+def replace_top_border(current_border, top):
+    """
+    Set the top border while keeping the other sides of the current border
+    """
+    return Border(top=top, left=current_border.left, right=current_border.right, bottom=current_border.bottom)
+
+
+class StyleRegistry():
+    """
+    Interns the styles given to cells while formatting, each (current style, build, overlay) combination is built and added to
+    the workbook's style tables once and every other cell only gets the style id
+
+    This depends on private openpyxl internals, like openpyxl's own style setters it sets the style ids of the cell's StyleArray in
+    cell._style and adds the styles to the workbook's workbook._borders, workbook._alignments and workbook._fills lists. They are
+    only known to hold for openpyxl 3.1, don't loosen the <3.2 pin in config/requirements.txt without re-running
+    test_style_registry_matches_style_setters, which compares the result with openpyxl's own style setters
+    """
+    _registries = weakref.WeakKeyDictionary()
+
+    def __init__(self, workbook) -> None:
+        self.workbook = workbook
+        self.style_ids = {}
+
+    @classmethod
+    def for_workbook(cls, workbook) -> 'StyleRegistry':
+        registry = cls._registries.get(workbook)
+        if registry is None:
+            registry = cls._registries[workbook] = cls(workbook)
+        return registry
+
+    def set_style(self, cell, slot, overlay, build):
+        """
+        Give the cell the style build(current style, overlay) returns, overlay is a hashable openpyxl style object and build a
+        module level function so both identify the result
+        """
+        # Like openpyxl, cells without a style get their own style array first
+        if not cell._style:
+            cell._style = StyleArray()
+        current_id = getattr(cell._style, slot)
+        key = (slot, build, overlay, current_id)
+        style_id = self.style_ids.get(key)
+        if style_id is None:
+            collection = getattr(self.workbook, STYLE_COLLECTIONS[slot])
+            style_id = self.style_ids[key] = collection.add(build(collection[current_id], overlay))
+        setattr(cell._style, slot, style_id)
+
+    def combine_border(self, cell, new_border):
+        self.set_style(cell, 'borderId', new_border, combine_borders)
+
+    def set_alignment(self, cell, alignment):
+        self.set_style(cell, 'alignmentId', alignment, replace_style)
+
+    def set_fill(self, cell, fill):
+        self.set_style(cell, 'fillId', fill, replace_style)
+
+
+# Medium borders drawn around every block of data
+MEDIUM_BORDERS = {side: Border(**{side: Side(style='medium')}) for side in ['top', 'bottom', 'left', 'right']}
+
+
 def insert_page_break(worksheet):
     # Assuming you want the page break after column C, for instance
     col_num = 6
@@ -46,42 +120,66 @@ def insert_page_break(worksheet):
 
 
 def add_summary_name_block(worksheet, locations):
-    # Loop through the rows of the worksheet
-    for row in range(locations['Summary']["row"] + 1, worksheet.max_row + 1):  # Assuming you start checking from the second row
+    styles = StyleRegistry.for_workbook(worksheet.parent)
+
+    # Loop through the rows of the worksheet and the row below them, which gets the divider closing the last name
+    for row in range(locations['Summary']["row"] + 1, worksheet.max_row + 2):  # Assuming you start checking from the second row
         # Check if the value in column B of the current row is different from the previous row
         if worksheet[f"B{row}"].value != worksheet[f"B{row-1}"].value:
             # If it is, apply the border to columns B through E for the current row
             for col in ['B', 'C', 'D', 'E']:
-                # Get the current borders of the cell
-                current_border = worksheet[f"{col}{row}"].border
-                # Update the top border while maintaining other borders
-                worksheet[f"{col}{row}"].border = Border(
-                    top=Side(style='thin'),
-                    left=current_border.left,
-                    right=current_border.right,
-                    bottom=current_border.bottom
-                )
+                # Update the top border while maintaining the other borders of the cell
+                styles.set_style(worksheet[f"{col}{row}"], 'borderId', Side(style='thin'), replace_top_border)
     logging.info("Inserted name dividers in summary sheet")
 
 
-def format_sheet(workbook, workbook_filename, worksheet, template_sheet, locations, dataframes):
-    # Create a white fill for the current worksheet
-    fill_white_worksheet(worksheet)
+def format_sheet(worksheet, template_sheet, locations, dataframes, summary_block=None):
+    # Create a white fill for the columns of the current worksheet
+    last_column = fill_white_columns(worksheet)
+
+    # The blocks of data on the sheet are shared by the border and autosize passes
+    blocks = sheet_blocks(template_sheet, locations, dataframes, summary_block)
 
     # Create borders
-    create_border_and_align_worsheet(template_sheet, worksheet, locations, dataframes)
+    create_border_and_align_worsheet(template_sheet, worksheet, blocks, last_column)
 
     # Auto size columns
-    autosize_columns_worksheet(worksheet, template_sheet)
+    autosize_columns_worksheet(worksheet, template_sheet, blocks)
+
+    # Do special formatting for the summary worksheet
+    if template_sheet == 'Summary':
+        format_summary_sheet(worksheet, locations)
 
-    # Save workbook
-    workbook.save(workbook_filename)
+    # Fill the cells last so the cells created by the steps above are white as well
+    fill_white_cells(worksheet)
     logging.info(f'Formatted {worksheet}')
 
 
-def format_all_code_sheets(workbook_filename, dataframes, invoice_sheet_name):
-    # Load workbook
-    workbook = openpyxl.load_workbook(workbook_filename)
+def format_summary_sheet(worksheet, locations):
+    # Make borders for summary sheet
+    add_summary_name_block(worksheet, locations)
+
+    # Insert page break to export pdf
+    insert_page_break(worksheet)
+
+    # Make column E wrap text in summary sheet
+    wrap_text_col(worksheet, 'E', 'E9')
+
+    # Set page break header
+    set_page_break_header(worksheet)
+
+    # Created banded rows for readability
+    create_summary_banded_rows(worksheet, locations)
+
+    # Top align rows
+    top_align_summary_rows(worksheet, locations)
+
+
+def format_all_code_sheets(output_workbook, dataframes, invoice_sheet_name, summary_block=None):
+    """
+    Format the sheets of one charge code, summary_block is the block paste_all_to_excel wrote to the summary sheet
+    """
+    workbook = output_workbook.workbook
 
     for template_sheet in template_sheets:
         if template_sheet == "Mismatch":
@@ -97,165 +195,178 @@ def format_all_code_sheets(workbook_filename, dataframes, invoice_sheet_name):
         # Determine location of items in worksheets
         locations = globals()[f'{template_sheet.lower()}_loc']
 
-        # Apply general formatting
-        format_sheet(workbook, workbook_filename, worksheet, template_sheet, locations, dataframes)
+        # Apply general formatting, the summary sheet also gets its name dividers, banded rows and print setup
+        format_sheet(worksheet, template_sheet, locations, dataframes, summary_block)
 
         # Wrap comment in col Y
         # if template_sheet == 'Detail':
         #    wrap_text_col(worksheet, 'X', 'X2')
         #    wrap_text_col(worksheet, 'Y', 'Y2')
 
-        # Do special formatting for the summary worksheet
-        if template_sheet == 'Summary':
+    logging.info("Completed formatting for charge code sheets\n")
 
-            # Make borders for summary sheet
-            add_summary_name_block(worksheet, locations)
 
-            # Insert page break to export pdf
-            insert_page_break(worksheet)
+# White background of every formatted sheet
+WHITE_FILL = PatternFill(start_color='FFFFFFFF', end_color='FFFFFFFF', fill_type='solid')
 
-            # Make column E wrap text in summary sheet
-            wrap_text_col(worksheet, 'E', 'E9')
 
-            # Set page break header
-            set_page_break_header(worksheet)
+def fill_white_columns(worksheet) -> int:
+    # Columns past the data get the fill as well, like the 10 extra columns filled before
+    max_column_to_fill = worksheet.max_column + 10
+    split_column_dimensions(worksheet, max_column_to_fill)
 
-            # Created banded rows for readability
-            create_summary_banded_rows(worksheet, locations)
+    # Column styles give every empty cell a white background without creating the cells
+    for column_dimension in worksheet.column_dimensions.values():
+        column_dimension.fill = WHITE_FILL
+    for column in range(1, max_column_to_fill + 1):
+        worksheet.column_dimensions[get_column_letter(column)].fill = WHITE_FILL
 
-            # Top align rows
-            top_align_summary_rows(worksheet, locations)
+    logging.debug(f"Applied white fill to the worksheet up to column: {get_column_letter(max_column_to_fill)}")
+    return max_column_to_fill
 
-        workbook.save(workbook_filename)
-    logging.info("Completed formatting for charge code sheets\n")
 
+def fill_white_cells(worksheet):
+    # Cells that exist carry their own style, which hides the column fill, so those get the fill on the cell
+    styles = StyleRegistry.for_workbook(worksheet.parent)
+    for cell in worksheet._cells.values():
+        styles.set_fill(cell, WHITE_FILL)
 
-def fill_white_worksheet(worksheet):
-    # Define white fill
-    white_fill = PatternFill(start_color='FFFFFFFF', end_color='FFFFFFFF', fill_type='solid')
 
-    # Assuming we want to fill up to column 'Z' (for example) which is the 26th column
-    # If you want to fill until the last column you expect data could be in, set this higher
-    max_column_to_fill = worksheet.max_column + 10
+def split_column_dimensions(worksheet, last_column):
+    """
+    Give each column up to last_column its own dimension so column ranges from the template don't overlap them
+    """
+    for column_dimension in list(worksheet.column_dimensions.values()):
+        if not column_dimension.min or not column_dimension.max or column_dimension.max <= column_dimension.min:
+            continue
+        if column_dimension.min > last_column:
+            continue
 
-    # To find the maximum touched column (by style or value), we loop through cells
-    # We set this to a minimum of the existing max column in case there's styled but empty cells beyond it
-    for row in worksheet.iter_rows(min_row=1, max_row=worksheet.max_row, min_col=1):
-        for cell in row:
-            if cell.value or cell.has_style:  # Check if cell has value or style
-                max_column_to_fill = max(max_column_to_fill, cell.column)
+        # Copy the range settings onto each column it covered
+        range_end = column_dimension.max
+        for column in range(column_dimension.min + 1, min(range_end, last_column) + 1):
+            _copy_column_dimension(worksheet, column_dimension, column, column)
 
-    # Now iterate over the range of rows and columns to apply the fill
-    for row in worksheet.iter_rows(min_row=1, max_row=worksheet.max_row + 50, min_col=1, max_col=max_column_to_fill):
-        for cell in row:
-            cell.fill = white_fill
+        # Keep a single range for everything after last_column
+        if range_end > last_column:
+            _copy_column_dimension(worksheet, column_dimension, last_column + 1, range_end)
+        column_dimension.max = column_dimension.min
 
-    logging.debug(f"Applied white fill to the worksheet up to column: {get_column_letter(max_column_to_fill)}")
 
+def _copy_column_dimension(worksheet, column_dimension, min_column, max_column):
+    letter = get_column_letter(min_column)
+    new_dimension = copy(column_dimension)
+    new_dimension.index = letter
+    new_dimension.min = min_column
+    new_dimension.max = max_column
+    worksheet.column_dimensions[letter] = new_dimension
 
-def create_border_and_align_worsheet(template_sheet, worksheet, locations, dataframes):
 
+def sheet_blocks(template_sheet, locations, dataframes, summary_block=None) -> dict[str, tuple[int, int, pd.DataFrame]]:
+    """
+    First data row, first column and the frame pasted for every block of data on the sheet, the summary block is only built when
+    it isn't given
+    """
+    blocks = {}
     for key in locations:
-        # Apply no borders if there's no data
-        if dataframes[key].empty:
+        df = dataframes[key]
+        if df is None or df.empty:
             continue
 
-        # Determine starting location
+        # The problem sheet only gets the name and date, the summary sheet gets subtotal rows in between
+        if template_sheet == "Problem":
+            df = df[['Name', 'Date']]
+        elif template_sheet == "Summary":
+            df = (summary_block if summary_block is not None else ut.build_summary_block(df)).drop(columns='Subtotal Row')
+
+        blocks[key] = (locations[key]["row"], locations[key]["col"], df)
+    return blocks
+
+
+def create_border_and_align_worsheet(template_sheet, worksheet, blocks, last_column=None):
+    styles = StyleRegistry.for_workbook(worksheet.parent)
+    center_alignment = Alignment(horizontal="center")
+
+    # Titles are centered across the whole row, up to the last column with the white fill
+    last_column = last_column or worksheet.max_column
+
+    for key, (data_row, start_col, df) in blocks.items():
+        # Determine starting location, the block includes the title row above the headers except on the summary sheet
         if template_sheet == "Summary":
-            start_row = locations[key]["row"] - 1
+            start_row = data_row - 1
         else:
-            start_row = locations[key]["row"] - 2
-        start_col = locations[key]["col"]
-
-        # Center titles for data
-        for cell in worksheet[start_row + 1]:
-            if template_sheet == "Summary":
-                continue
-            cell.alignment = Alignment(horizontal="center")
-
-        # Find the end column for the data
-        end_col = start_col
-        while worksheet.cell(row=start_row + 1, column=end_col).value and end_col <= worksheet.max_column:
-            end_col += 1
-        end_col -= 1
-
-        # Find the end row for the data
-        end_row = start_row
-        while worksheet.cell(row=end_row, column=start_col).value and end_row <= worksheet.max_row:
-            end_row += 1
-        end_row -= 1
-
-        # Define thick borders
-        thick_border_top = Border(top=Side(style='medium'))
-        thick_border_bottom = Border(bottom=Side(style='medium'))
-        thick_border_left = Border(left=Side(style='medium'))
-        thick_border_right = Border(right=Side(style='medium'))
+            start_row = data_row - 2
+
+            # Center titles for data
+            for col in range(1, last_column + 1):
+                styles.set_alignment(worksheet.cell(row=start_row + 1, column=col), center_alignment)
+
+        # The block ends at the last row and column of the data
+        end_col = start_col + len(df.columns) - 1
+        end_row = data_row + len(df.index) - 1
 
         # Apply top and bottom borders
         for col in range(start_col, end_col + 1):
-            current_cell = worksheet.cell(row=start_row, column=col)
-            current_cell.border = combine_borders(current_cell.border, thick_border_top)
-
-            current_cell = worksheet.cell(row=end_row, column=col)
-            current_cell.border = combine_borders(current_cell.border, thick_border_bottom)
+            styles.combine_border(worksheet.cell(row=start_row, column=col), MEDIUM_BORDERS['top'])
+            styles.combine_border(worksheet.cell(row=end_row, column=col), MEDIUM_BORDERS['bottom'])
 
         # Apply left and right borders
         for row in range(start_row, end_row):
-            current_cell = worksheet.cell(row=row, column=start_col)
-            current_cell.border = combine_borders(current_cell.border, thick_border_left)
-
-            current_cell = worksheet.cell(row=row, column=end_col)
-            current_cell.border = combine_borders(current_cell.border, thick_border_right)
+            styles.combine_border(worksheet.cell(row=row, column=start_col), MEDIUM_BORDERS['left'])
+            styles.combine_border(worksheet.cell(row=row, column=end_col), MEDIUM_BORDERS['right'])
 
         # Special handling for bottom left and right corners
         bottom_left_cell = worksheet.cell(row=end_row, column=start_col)
-        bottom_left_cell.border = combine_borders(bottom_left_cell.border, thick_border_left)
-        bottom_left_cell.border = combine_borders(bottom_left_cell.border, thick_border_bottom)
+        styles.combine_border(bottom_left_cell, MEDIUM_BORDERS['left'])
+        styles.combine_border(bottom_left_cell, MEDIUM_BORDERS['bottom'])
 
         bottom_right_cell = worksheet.cell(row=end_row, column=end_col)
-        bottom_right_cell.border = combine_borders(bottom_right_cell.border, thick_border_right)
-        bottom_right_cell.border = combine_borders(bottom_right_cell.border, thick_border_bottom)
+        styles.combine_border(bottom_right_cell, MEDIUM_BORDERS['right'])
+        styles.combine_border(bottom_right_cell, MEDIUM_BORDERS['bottom'])
 
         # Save the changes
         logging.debug(f"Applied Borders and aligned titled in sheet: {worksheet}")
 
 
-def autosize_columns_worksheet(worksheet, template_sheet):
-    # Loop through each column in worksheet using iter_cols
-    for col in worksheet.iter_cols():
-        max_length = 0
-        column = col  # No need to list comprehension here; 'col' is already a tuple of cells.
-        for cell in column:
-            # Skip rows based on template_sheet condition.
-            if template_sheet == "Summary" and cell.row < 9:
-                continue
-            try:
-                # Try to find the length of the cell value
-                if cell.value and len(str(cell.value)) > max_length:
-                    max_length = len(str(cell.value))  # Convert cell value to string before measuring length.
-            except Exception as e:
-                logging.debug(f"Error processing cell: {cell} with error: {e}")
-                pass  # In case of any error, continue without breaking the loop.
+def autosize_columns_worksheet(worksheet, template_sheet, blocks):
+    max_lengths = {}
+
+    # Only the rows above the data are read from the sheet, the summary sheet skips its title rows
+    min_row = 9 if template_sheet == "Summary" else 1
+    max_row = min([data_row for data_row, _, _ in blocks.values()], default=worksheet.max_row + 1) - 1
+    for row in worksheet.iter_rows(min_row=min_row, max_row=max_row):
+        for cell in row:
+            if cell.value:
+                max_lengths[cell.column] = max(max_lengths.get(cell.column, 0), len(str(cell.value)))
 
+    # The longest value in every pasted column comes straight from the dataframes
+    for data_row, start_col, df in blocks.values():
+        for col, column_name in enumerate(df.columns, start=start_col):
+            max_length = df[column_name].dropna().astype(str).str.len().max()
+            if pd.notna(max_length):
+                max_lengths[col] = max(max_lengths.get(col, 0), int(max_length))
+
+    for col in range(1, worksheet.max_column + 1):
         # Set a minimum width and a maximum width for the column.
-        adjusted_width = max((max_length + 2), 10)  # Set a minimum width to 10
+        adjusted_width = max((max_lengths.get(col, 0) + 2), 10)  # Set a minimum width to 10
         adjusted_width = min(adjusted_width, 68)  # Set a maximum width to 68 to prevent very wide columns.
 
         # Set the column width using column_dimensions and get_column_letter
-        if column:  # Check if the column tuple is not empty.
-            worksheet.column_dimensions[get_column_letter(column[0].column)].width = adjusted_width
+        worksheet.column_dimensions[get_column_letter(col)].width = adjusted_width
 
     # Log the debug message after all columns have been adjusted.
     logging.debug("Adjusted column sizes for template_sheet: {}".format(template_sheet))
 
 
 def wrap_text_col(worksheet, column, align_cell=None):
+    styles = StyleRegistry.for_workbook(worksheet.parent)
+
     # Set wrap text style for each cell in column E
+    wrap_alignment = Alignment(wrap_text=True)
     for cell in worksheet[column]:  # This will iterate over all cells in column E
-        cell.alignment = Alignment(wrap_text=True)
+        styles.set_alignment(cell, wrap_alignment)
     if align_cell is not None:
-        cell = worksheet[align_cell]
-        cell.alignment = Alignment(horizontal="center")
+        styles.set_alignment(worksheet[align_cell], Alignment(horizontal="center"))
 
 
 def set_page_break_header(worksheet):
@@ -272,23 +383,14 @@ def create_summary_banded_rows(worksheet, locations, band_size=1):
     end_col = 5  # Col E
     end_row = worksheet.max_row
 
-    # Define the fill styles for banded rows
+    # Define the fill style for the shaded bands, the other bands keep the white background
     odd_fill = PatternFill(start_color='00CCCCCC', end_color='00CCCCCC', fill_type='solid')
-    even_fill = PatternFill(start_color='FFFFFFFF', end_color='FFFFFFFF', fill_type='solid')
-
-    # Apply the fill styles
-    for row in range(start_row, end_row + 1, band_size * 2):  # Start from start_row, go up by double the band size
-        for band_row in range(row, min(row + band_size, end_row + 1)):  # Apply the odd_fill for band_size rows
-            for col in range(start_col, end_col + 1):
-                cell = worksheet.cell(row=band_row, column=col)
-                if worksheet.cell(row=band_row, column=2).value not in (None, ""):  # Check if the cell in column B is not empty
-                    cell.fill = odd_fill
 
-        for band_row in range(row + band_size, min(row + band_size * 2, end_row + 1)):  # Apply the even_fill for the next band_size rows
-            for col in range(start_col, end_col + 1):
-                cell = worksheet.cell(row=band_row, column=col)
-                if worksheet.cell(row=band_row, column=2).value not in (None, ""):  # Check if the cell in column B is not empty
-                    cell.fill = even_fill
+    # Shade band_size rows out of every band_size * 2, only where there's a name in column B
+    start_cell = f'{get_column_letter(start_col)}{start_row}'
+    cell_range = f'{start_cell}:{get_column_letter(end_col)}{end_row}'
+    formula = f'AND(MOD(ROW()-{start_row},{band_size * 2})<{band_size},$B{start_row}<>"")'
+    worksheet.conditional_formatting.add(cell_range, FormulaRule(formula=[formula], fill=odd_fill))
 
 
 def top_align_summary_rows(worksheet, locations):
@@ -299,7 +401,8 @@ def top_align_summary_rows(worksheet, locations):
     end_row = worksheet.max_row
 
     # Top align only column A
+    styles = StyleRegistry.for_workbook(worksheet.parent)
     top_alignment = Alignment(vertical='top')
     for row in worksheet.iter_rows(min_row=start_row, max_row=end_row, min_col=start_col, max_col=end_col):
         for cell in row:
-            cell.alignment = top_alignment
+            styles.set_alignment(cell, top_alignment)
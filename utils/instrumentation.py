@@ -0,0 +1,148 @@
+import functools
+import json
+import logging
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from config.settings import run_report_filename
+
+# Finished stage records of this process and the stages that are still running
+_records = []
+_running = []
+
+
+@contextmanager
+def stage(name, rows_in=None, **labels):
+    """
+    Record wall time, CPU time, peak traced memory and row counts of a pipeline step
+
+    Labels such as workbook and charge_code are inherited by the stages nested inside
+    """
+    parent = _running[-1] if _running else None
+    stage_labels = {**(parent['labels'] if parent else {}), **labels}
+    record = {'labels': stage_labels, 'stage': name, 'rows_in': rows_in, 'rows_out': None, 'peak_memory_mb': None, 'peak_bytes': 0}
+
+    # The traced peak is reset per stage, the enclosing stage keeps the highest peak of its children
+    if tracemalloc.is_tracing():
+        if parent:
+            parent['peak_bytes'] = max(parent['peak_bytes'], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+
+    _running.append(record)
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+    try:
+        yield record
+    finally:
+        record['wall_seconds'] = round(time.perf_counter() - start_wall, 4)
+        record['cpu_seconds'] = round(time.process_time() - start_cpu, 4)
+        _running.pop()
+
+        if tracemalloc.is_tracing():
+            record['peak_bytes'] = max(record['peak_bytes'], tracemalloc.get_traced_memory()[1])
+            record['peak_memory_mb'] = round(record['peak_bytes'] / 2 ** 20, 2)
+            if parent:
+                parent['peak_bytes'] = max(parent['peak_bytes'], record['peak_bytes'])
+            tracemalloc.reset_peak()
+
+        labels = record.pop('labels')
+        record.pop('peak_bytes')
+        _records.append({**labels, **record})
+
+
+def timed_method(method):
+    """
+    Run a CleanData method as a stage, the rows of self.df are counted before and after
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with stage(method.__name__, rows_in=len(self.df.index)) as record:
+            result = method(self, *args, **kwargs)
+            record['rows_out'] = len(self.df.index)
+        return result
+    return wrapper
+
+
+def start_memory_tracing():
+    # Tracing roughly doubles the run time, so it's only turned on when asked for
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def tracing_memory() -> bool:
+    return tracemalloc.is_tracing()
+
+
+def reset():
+    # Forked worker processes start with a copy of the parent's records and running stages
+    _records.clear()
+    _running.clear()
+
+
+def drain_records() -> list[dict]:
+    """
+    Take the finished records, used to send the records of a worker process back to the parent
+    """
+    records = _records.copy()
+    _records.clear()
+    return records
+
+
+def add_records(records, **labels):
+    # Records from worker processes get the labels of the parent's enclosing stages
+    parent_labels = _running[-1]['labels'] if _running else {}
+    _records.extend({**parent_labels, **labels, **record} for record in records)
+
+
+def summarize(records) -> list[dict]:
+    """
+    Totals per stage name, in the order the stages first ran
+    """
+    totals = {}
+    for record in records:
+        total = totals.setdefault(record['stage'], {'stage': record['stage'], 'calls': 0, 'wall_seconds': 0, 'cpu_seconds': 0,
+                                                    'peak_memory_mb': None, 'rows_in': 0, 'rows_out': 0})
+        total['calls'] += 1
+        total['wall_seconds'] = round(total['wall_seconds'] + record['wall_seconds'], 4)
+        total['cpu_seconds'] = round(total['cpu_seconds'] + record['cpu_seconds'], 4)
+        total['rows_in'] += record['rows_in'] or 0
+        total['rows_out'] += record['rows_out'] or 0
+        if record['peak_memory_mb'] is not None:
+            total['peak_memory_mb'] = max(total['peak_memory_mb'] or 0, record['peak_memory_mb'])
+    return list(totals.values())
+
+
+def format_stage_table(summary) -> str:
+    lines = [f'{"stage":<28}{"calls":>7}{"wall s":>10}{"cpu s":>10}{"peak MB":>10}{"rows in":>10}{"rows out":>10}']
+    for total in summary:
+        peak_memory = '' if total['peak_memory_mb'] is None else f'{total["peak_memory_mb"]:.1f}'
+        lines.append(f'{total["stage"]:<28}{total["calls"]:>7}{total["wall_seconds"]:>10.3f}{total["cpu_seconds"]:>10.3f}'
+                     f'{peak_memory:>10}{total["rows_in"]:>10}{total["rows_out"]:>10}')
+    return '\n'.join(lines)
+
+
+def write_run_report(report_filename=run_report_filename):
+    """
+    Log a per-stage table and write every record of the run to a JSON report, then start over for the next run
+    """
+    records = drain_records()
+    if not records:
+        return
+
+    summary = summarize(records)
+    logging.info('Stage timings\n' + format_stage_table(summary))
+
+    report = {
+        'finished': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'memory_traced': tracemalloc.is_tracing(),
+        'stages': summary,
+        'records': records
+    }
+    os.makedirs(os.path.dirname(report_filename) or '.', exist_ok=True)
+    with open(report_filename, 'w', encoding='utf-8') as file:
+        json.dump(report, file, indent=2)
+    logging.info(f'Wrote run report {report_filename}')
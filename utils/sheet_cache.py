@@ -0,0 +1,127 @@
+import functools
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+import time
+import pandas as pd
+import config.settings as settings
+import utils.clean_data as cd
+import utils.time_parsing as tp
+
+
+@functools.lru_cache(maxsize=None)
+def code_version() -> bytes:
+    """
+    Fingerprint of cache_version, the settings and the cleaning code, a change to any of them invalidates every cached sheet
+    """
+    hasher = hashlib.sha256(f'{settings.cache_version} {pd.__version__}'.encode())
+    for module in (settings, cd, tp):
+        try:
+            with open(module.__file__, 'rb') as file:
+                hasher.update(file.read())
+        except (OSError, TypeError):
+            # The bundled executable has no sources, only cache_version tells its releases apart
+            hasher.update(module.__name__.encode())
+    return hasher.digest()
+
+
+def sheet_key(import_df: pd.DataFrame) -> str:
+    """
+    Content hash of one charge code sheet as read from the invoice
+    """
+    hasher = hashlib.sha256(code_version())
+    hasher.update('\x1f'.join(map(str, import_df.columns)).encode())
+    hasher.update(pd.util.hash_pandas_object(import_df, index=False).to_numpy().tobytes())
+    return hasher.hexdigest()
+
+
+def cache_folder_path() -> str:
+    """
+    Folder of the cached sheets, only the current user can write there since every entry is unpickled when read
+    """
+    if settings.cache_folder:
+        return settings.cache_folder
+    base_folder = os.environ.get('LOCALAPPDATA') or os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base_folder, 'PBGC_Billing_Automation', 'sheets')
+
+
+def load_sheet(key: str, cache_folder: str | None = None) -> dict[str, pd.DataFrame] | None:
+    path = os.path.join(cache_folder or cache_folder_path(), f'{key}.pkl')
+    try:
+        # The modified time of an entry is its last use, prune_cache removes the least recently used entries first
+        os.utime(path)
+        with open(path, 'rb') as file:
+            return pickle.load(file)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        # A corrupt entry is recomputed and overwritten
+        logging.warning(f'Ignoring unreadable cache entry {path}: {e}')
+        return None
+
+
+def store_sheet(key: str, dataframes: dict[str, pd.DataFrame], cache_folder: str | None = None):
+    cache_folder = cache_folder or cache_folder_path()
+    os.makedirs(cache_folder, mode=0o700, exist_ok=True)
+
+    # Write to a temporary file first so parallel workers never read a partial entry
+    file_descriptor, temp_path = tempfile.mkstemp(dir=cache_folder, suffix='.tmp')
+    try:
+        with os.fdopen(file_descriptor, 'wb') as file:
+            pickle.dump(dataframes, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, os.path.join(cache_folder, f'{key}.pkl'))
+    except Exception:
+        os.remove(temp_path)
+        raise
+
+    prune_cache(cache_folder)
+
+
+def prune_cache(cache_folder: str, max_age_days=None, max_megabytes=None):
+    """
+    Remove entries unused for max_age_days, then the least recently used ones until the rest fits in max_megabytes
+    """
+    max_age_days = settings.cache_max_age_days if max_age_days is None else max_age_days
+    max_megabytes = settings.cache_max_megabytes if max_megabytes is None else max_megabytes
+
+    # Temporary files only count for the age bound, a recent one may still be written by a worker
+    oldest_kept = time.time() - max_age_days * 24 * 60 * 60
+    entries = []
+    for entry in os.scandir(cache_folder):
+        if entry.name.endswith(('.pkl', '.tmp')) and entry.is_file():
+            stat = entry.stat()
+            size = stat.st_size if entry.name.endswith('.pkl') else 0
+            entries.append((stat.st_mtime, size, entry.path))
+
+    # Newest first, everything past the age or size bound is removed
+    total_bytes = 0
+    for modified_time, size, path in sorted(entries, reverse=True):
+        total_bytes += size
+        if modified_time >= oldest_kept and (size == 0 or total_bytes <= max_megabytes * 1024 * 1024):
+            continue
+        try:
+            os.remove(path)
+            logging.debug(f'Removed cache entry {path}')
+        except OSError:
+            # Another worker removed or is still writing it
+            pass
+
+
+def clean_sheet_data_cached(import_df: pd.DataFrame, use_cache: bool = True) -> dict[str, pd.DataFrame]:
+    """
+    clean_sheet_data, reusing the result of an earlier run when the sheet and the code are unchanged
+    """
+    if not use_cache:
+        return cd.clean_sheet_data(import_df)
+
+    key = sheet_key(import_df)
+    dataframes = load_sheet(key)
+    if dataframes is not None:
+        logging.info(f'Reused cached results for {import_df["Charge Code"].iloc[0] if not import_df.empty else "empty sheet"}')
+        return dataframes
+
+    dataframes = cd.clean_sheet_data(import_df)
+    store_sheet(key, dataframes)
+    return dataframes
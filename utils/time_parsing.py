@@ -0,0 +1,191 @@
+import functools
+import re
+import numpy as np
+import pandas as pd
+from config.settings import comment_cache_size
+
+# This pattern looks for pairs of times
+TIME_PAIR_PATTERN = re.compile(r"(?:time in:?\s*(\d{1,2}:\d{2}))\s*[-,–]?\s*(?:time out:?\s*(\d{1,2}:\d{2}))", re.I)
+
+# Matches every time in a comment, paired or not
+TIME_PATTERN = re.compile(r"\b\d{1,2}:\d{2}\b")
+
+# Out times that are treated like the end of the day
+MIDNIGHT_OUT_TIMES = ["00:00", "24:00", "0:00"]
+
+# Minute endings accepted for quarter hour time stamps
+VALID_ENDINGS = ["00", "15", "30", "45", "59"]
+
+
+# Bits of the 'Short Hours' column, set when the hour of the time in or time out was written with a single digit
+SHORT_IN_HOUR = 1
+SHORT_OUT_HOUR = 2
+
+
+def parse_time_comments(comments: pd.Series) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Parse a column of time comments, every distinct comment is parsed once and repeated comments come from the parse cache
+
+    Returns the Format Issue, Commented Time Worked and Formatted Time Comments of each comment, and a table with one row per time
+    pair holding the index label of the comment, the position of the pair in the comment, the in and out minutes past midnight and
+    the 'Short Hours' bits, so '8:00' and '08:00' can still be told apart
+    """
+    # Comments are matched case-insensitively, so the cache is keyed by the stripped lower case text
+    codes, keys = pd.factorize(comments.astype(str).str.strip().str.lower().to_numpy())
+    parsed = [parse_comment(key) for key in keys]
+
+    # Distinct comments as arrays, their pairs are laid out one after another
+    format_issue = np.array([comment[0] for comment in parsed], dtype=bool)
+    commented_time_worked = np.array([comment[1] for comment in parsed], dtype=float)
+    formatted_comments = np.array([comment[2] for comment in parsed], dtype=object)
+    pair_counts = np.array([len(comment[3]) for comment in parsed], dtype=np.intp)
+    pair_values = np.array([pair for comment in parsed for pair in comment[3]], dtype=np.int16).reshape(-1, 3)
+
+    # Repeat the pairs of the distinct comments for every row that has that comment
+    row_pair_counts = pair_counts[codes]
+    rows = np.repeat(np.arange(len(codes)), row_pair_counts)
+    pair_index = np.arange(len(rows)) - np.repeat(np.cumsum(row_pair_counts) - row_pair_counts, row_pair_counts)
+    pair_offsets = np.repeat((np.cumsum(pair_counts) - pair_counts)[codes], row_pair_counts) + pair_index
+
+    comment_table = pd.DataFrame({
+        'Format Issue': format_issue[codes],
+        'Commented Time Worked': commented_time_worked[codes],
+        'Formatted Time Comments': formatted_comments[codes]
+    }, index=comments.index)
+    pair_table = pd.DataFrame({
+        'Row': comments.index[rows],
+        'Pair': pair_index.astype(np.int16),
+        'In Minutes': pair_values[pair_offsets, 0],
+        'Out Minutes': pair_values[pair_offsets, 1],
+        'Short Hours': pair_values[pair_offsets, 2].astype(np.uint8)
+    })
+    return comment_table, pair_table
+
+
+@functools.lru_cache(maxsize=comment_cache_size)
+def parse_comment(comment) -> tuple[bool, float, str, tuple]:
+    """
+    Format issue, commented hours, formatted comment and (in minutes, out minutes, short hours) pairs of one normalized comment
+    """
+    # Special handling for midnight formats
+    time_pairs = [(in_time, "23:59" if out_time in MIDNIGHT_OUT_TIMES else out_time) for in_time, out_time in TIME_PAIR_PATTERN.findall(comment)]
+
+    # Every time in the comment has to belong to a pair and end on a 15-minute interval
+    format_issue = not time_pairs or len(time_pairs) * 2 != len(TIME_PATTERN.findall(comment)) or \
+        any(in_time[-2:] not in VALID_ENDINGS or out_time[-2:] not in VALID_ENDINGS for in_time, out_time in time_pairs)
+
+    pairs = tuple((time_to_minutes(in_time), time_to_minutes(out_time), (len(in_time) == 4) * SHORT_IN_HOUR | (len(out_time) == 4) * SHORT_OUT_HOUR)
+                  for in_time, out_time in time_pairs)
+
+    # Total hours rounded to the nearest 0.25, only used when every time is a valid military time
+    commented_time_worked = float(np.round(sum(out_minutes - in_minutes for in_minutes, out_minutes, _ in pairs) / 15) / 4)
+    return format_issue, commented_time_worked, format_comment(pairs), pairs
+
+
+def comment_cache_stats() -> str:
+    cache_info = parse_comment.cache_info()
+    return f'{cache_info.hits} hits, {cache_info.misses} misses, {cache_info.currsize} of {cache_info.maxsize} cached'
+
+
+def pair_positions(time_pairs: pd.DataFrame, index: pd.Index) -> tuple[pd.DataFrame, np.ndarray]:
+    """
+    Keep the pairs of the comments still in index and give the position of their comment
+    """
+    time_pairs = time_pairs[time_pairs['Row'].isin(index)]
+    return time_pairs, index.get_indexer(time_pairs['Row'])
+
+
+# Minutes past midnight used for times that aren't valid military times
+INVALID_MINUTES = -1
+
+
+def times_to_minutes(times) -> np.ndarray:
+    """
+    Parse HH:MM strings into minutes past midnight in a single pass
+    """
+    parts = pd.Series(times, dtype=object).astype(str).str.extract(r"^(\d{1,2}):(\d{2})$")
+    hours = pd.to_numeric(parts[0]).fillna(-1).to_numpy(dtype=np.int64)
+    minutes = pd.to_numeric(parts[1]).fillna(-1).to_numpy(dtype=np.int64)
+
+    # Times such as 24:00 or 12:62 don't exist on a 24 hour clock
+    valid = (hours >= 0) & (hours <= 23) & (minutes >= 0) & (minutes <= 59)
+    return np.where(valid, hours * 60 + minutes, INVALID_MINUTES)
+
+
+def time_to_minutes(time) -> int:
+    # Same as times_to_minutes for a single time
+    hours, minutes = (int(part) for part in time.split(':'))
+    return hours * 60 + minutes if 0 <= hours <= 23 and 0 <= minutes <= 59 else INVALID_MINUTES
+
+
+def find_military_time_issues(rows: np.ndarray, in_minutes: np.ndarray, out_minutes: np.ndarray, row_count: int) -> np.ndarray:
+    """
+    Flag comments with an invalid time or a time out that isn't after its time in
+    """
+    issue = (in_minutes == INVALID_MINUTES) | (out_minutes == INVALID_MINUTES) | (out_minutes <= in_minutes)
+    return np.bincount(rows, weights=issue, minlength=row_count) > 0
+
+
+def sum_time_worked(rows: np.ndarray, in_minutes: np.ndarray, out_minutes: np.ndarray, row_count: int) -> np.ndarray:
+    """
+    Total hours per comment rounded to the nearest 0.25
+    """
+    total_minutes = np.bincount(rows, weights=out_minutes - in_minutes, minlength=row_count)
+    return np.round(total_minutes / 15) / 4
+
+
+def format_comment(pairs) -> str:
+    """
+    Rebuild a comment as 'Time in: HH:MM - Time out: HH:MM' pairs separated by a semicolon, with a newline after every second pair
+    """
+    formatted = ''
+    for pair_index, (in_minutes, out_minutes, _) in enumerate(pairs):
+        if pair_index:
+            formatted += '\n' if pair_index % 2 == 0 else '; '
+
+        # Out times of 23:59 are written as 00:00 of the next day, generally considered as '24:00'
+        out_minutes = 0 if out_minutes == 23 * 60 + 59 else out_minutes
+        formatted += f'Time in: {_minutes_to_text(in_minutes)} - Time out: {_minutes_to_text(out_minutes)}'
+    return formatted
+
+
+def hash_time_pairs(rows: np.ndarray, time_pairs: pd.DataFrame, row_count: int) -> np.ndarray:
+    """
+    One 64-bit hash per comment of its ordered time pairs, comments without pairs hash to 0
+    """
+    # Pack each pair into one integer, the minutes are masked so invalid times can't spill into the other fields
+    packed = (time_pairs['Pair'].to_numpy().astype(np.uint64) << np.uint64(40)) | \
+        (time_pairs['Short Hours'].to_numpy().astype(np.uint64) << np.uint64(32)) | \
+        ((time_pairs['In Minutes'].to_numpy().astype(np.uint64) & np.uint64(0xFFFF)) << np.uint64(16)) | \
+        (time_pairs['Out Minutes'].to_numpy().astype(np.uint64) & np.uint64(0xFFFF))
+    pair_hashes = pd.util.hash_array(packed)
+
+    # The pair position is part of every pair hash, so summing them per comment keeps the order of the pairs
+    row_hashes = np.zeros(row_count, dtype=np.uint64)
+    pair_counts = np.bincount(rows, minlength=row_count)
+    has_pairs = pair_counts > 0
+    if has_pairs.any():
+        pair_starts = np.cumsum(pair_counts) - pair_counts
+        row_hashes[has_pairs] = pd.util.hash_array(np.add.reduceat(pair_hashes, pair_starts[has_pairs]))
+    return row_hashes
+
+
+def find_conflicting_pairs(groups: np.ndarray, rows: np.ndarray, time_pairs: pd.DataFrame) -> np.ndarray:
+    """
+    Flag every comment of a group (name and date) whose comments don't all have the same time pairs, groups of -1 are never flagged
+    """
+    row_hashes = hash_time_pairs(rows, time_pairs, len(groups))
+
+    # A group conflicts when the lowest and highest hash of its comments differ
+    grouped = groups >= 0
+    bounds = pd.Series(row_hashes[grouped]).groupby(groups[grouped]).agg(['min', 'max'])
+    group_conflict = (bounds['min'] != bounds['max']).to_numpy()
+
+    conflicting = np.zeros(len(groups), dtype=bool)
+    conflicting[grouped] = group_conflict[groups[grouped]]
+    return conflicting
+
+
+def _minutes_to_text(minutes) -> str:
+    # Format minutes past midnight as zero padded HH:MM
+    return f'{minutes // 60:02d}:{minutes % 60:02d}'
@@ -1,74 +1,304 @@
+import numpy as np
 import pandas as pd
 import logging
+import logging.handlers
+import multiprocessing
 import os
 import openpyxl
-import xlwings as xw
+import atexit
+import copy
+import functools
+import importlib.util
+import io
+import queue
 from config.settings import template_sheets, summary_loc, problem_loc, detail_loc, overbilled_loc, blacklist_charge_codes  # noqa: F401
+from config.settings import output_checkpoint_every, template_engine, log_level, log_sample_rows, input_engine, input_extensions
+from openpyxl.cell.cell import Cell, ILLEGAL_CHARACTERS_RE
 from openpyxl.styles import Alignment  # , Font
 
 
-def set_logger():
+class LazyFrame():
+    """
+    Render a DataFrame or Series for a log message only when the record passes the log level
+
+    Use as logging.debug('%s', LazyFrame(df)), the rows shown are limited to max_rows
+    """
+    max_rows = log_sample_rows
+
+    def __init__(self, df, max_rows=None) -> None:
+        self.df = df
+        self.max_rows = max_rows if max_rows is not None else LazyFrame.max_rows
+
+    def __str__(self):
+        return self.df.to_string(max_rows=self.max_rows or None)
+
+
+_log_listener = None
+
+
+def set_logger(log_filename='logfile.log', console=True, level=log_level, sample_rows=None):
     """
     Configure the logger for logging messages.
+
+    Records go through a queue to a listener thread that writes the console and file output, the message is rendered before it is
+    queued so later changes to the logged objects don't show up and the objects aren't kept alive by the queue
     """
+    stop_logger()
+
     # Get the root logger
     logger = logging.getLogger()
     while logger.hasHandlers():
         logger.removeHandler(logger.handlers[0])
 
-    logger.setLevel(logging.INFO)
+    # Messages below the level are dropped before any formatting happens
+    logger.setLevel(level)
+    if sample_rows is not None:
+        LazyFrame.max_rows = sample_rows
 
     # Set the log format
     formatter = logging.Formatter("%(asctime)s %(levelname)s: %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+    handlers = []
 
     # Set up console logging
-    console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.INFO)
-    logger.addHandler(console_handler)
-
-    # Set up file logging
-    file_handler = logging.FileHandler('logfile.log', mode="w")
+    if console:
+        console_handler = logging.StreamHandler()
+        console_handler.setLevel(logging.INFO)
+        handlers.append(console_handler)
+
+    # Set up file logging, the file is emptied once and then appended to so merged worker logs are never overwritten
+    open(log_filename, 'w').close()
+    file_handler = logging.FileHandler(log_filename, mode="a")
     file_handler.setLevel(logging.DEBUG)
     file_handler.setFormatter(formatter)
-    logger.addHandler(file_handler)
+    handlers.append(file_handler)
 
+    # The calling thread only puts records on the queue
+    global _log_listener
+    log_queue = queue.SimpleQueue()
+    _log_listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _log_listener.start()
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
 
-def read_excel_data(filename, sheet_name) -> pd.DataFrame:
-    logging.info(f"The current sheet is: {sheet_name}")
-    # Read the first column to determine where the data starts
-    df_full = pd.read_excel(f'input/{filename}', sheet_name=sheet_name, usecols=[0], engine='openpyxl')
 
-    # Find the row index where the column 'A' has the value 'Name', this row is likely before the headers
-    try:
-        name_row_idx = df_full[df_full.iloc[:, 0] == 'Name'].index[0]
-    except Exception:
+def stop_logger():
+    """
+    Write out every queued record and close the log files
+    """
+    global _log_listener
+    if _log_listener is None:
+        return
+
+    _log_listener.stop()
+    for handler in _log_listener.handlers:
+        handler.close()
+    _log_listener = None
+
+
+# Queued records are written out before the interpreter exits
+atexit.register(stop_logger)
+
+
+def flush_logger():
+    # Stopping the listener writes every queued record, it is started again right away
+    if _log_listener is not None:
+        _log_listener.stop()
+        for handler in _log_listener.handlers:
+            handler.flush()
+        _log_listener.start()
+
+
+def start_log_listener():
+    """
+    Forward log records sent by worker processes to this process's handlers
+    """
+    log_queue = multiprocessing.Queue()
+    listener = logging.handlers.QueueListener(log_queue, *logging.getLogger().handlers, respect_handler_level=True)
+    listener.start()
+    return log_queue, listener
+
+
+def set_worker_logger(log_queue, level=log_level):
+    """
+    Send every log record from a worker process to the parent's log listener
+    """
+    logger = logging.getLogger()
+    while logger.hasHandlers():
+        logger.removeHandler(logger.handlers[0])
+
+    logger.setLevel(level)
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+
+
+def merge_log_files(log_filenames, destination='logfile.log'):
+    """
+    Append the log files written by worker processes to the main log file
+    """
+    # Make sure everything logged so far is on disk before appending
+    flush_logger()
+
+    with open(destination, 'a') as destination_file:
+        for title, log_filename in log_filenames.items():
+            destination_file.write(f'\n----- {title} -----\n')
+            with open(log_filename) as log_file:
+                destination_file.write(log_file.read())
+            os.remove(log_filename)
+
+
+class InputWorkbook():
+    """
+    Invoice workbook opened once in read-only mode with openpyxl and shared by every charge code sheet
+    """
+    def __init__(self, filename, folder='input') -> None:
+        self.filename = filename
+        self.workbook = openpyxl.load_workbook(os.path.join(folder, filename), read_only=True, data_only=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        # Read-only workbooks keep the file open until closed
+        self.workbook.close()
+
+    def sheet_states(self) -> list[tuple[str, bool]]:
+        return [(sheet.title, sheet.sheet_state == 'visible') for sheet in self.workbook.worksheets]
+
+    def visible_sheet_names(self) -> list[str]:
+        # Get the list of visible sheet names
+        visible_sheet_names = [sheet_name for sheet_name, visible in self.sheet_states() if visible]
+
+        # Filter out the sheet names that are in the blacklist
+        return [sheet for sheet in visible_sheet_names if sheet not in blacklist_charge_codes]
+
+    def sheet_rows(self, sheet_name):
+        # Only the first five columns hold invoice data
+        return self.workbook[sheet_name].iter_rows(max_col=5, values_only=True)
+
+    def read_sheet(self, sheet_name) -> pd.DataFrame:
+        return frame_from_sheet_rows(self.sheet_rows(sheet_name))
+
+
+class CalamineWorkbook(InputWorkbook):
+    """
+    Invoice workbook read with the Rust based python-calamine package, much faster than openpyxl and also reads .xls files
+    """
+    def __init__(self, filename, folder='input') -> None:
+        from python_calamine import CalamineWorkbook as Workbook, SheetVisibleEnum
+        self.filename = filename
+        self.workbook = Workbook.from_path(os.path.join(folder, filename))
+        self.visible_state = SheetVisibleEnum.Visible
+
+    def sheet_states(self) -> list[tuple[str, bool]]:
+        return [(sheet.name, sheet.visible == self.visible_state) for sheet in self.workbook.sheets_metadata]
+
+    def sheet_rows(self, sheet_name):
+        # Keep the empty rows and columns around the data so the header is found in column A like with openpyxl
+        return (row[:5] for row in self.workbook.get_sheet_by_name(sheet_name).to_python(skip_empty_area=False))
+
+
+class TimesheetFile(InputWorkbook):
+    """
+    CSV or Parquet timesheet export with Name, Date, Hours Worked, Time Period and Charge Code columns, each charge code is read like a sheet
+    """
+    def __init__(self, filename, folder='input') -> None:
+        self.filename = filename
+        path = os.path.join(folder, filename)
+        self.df = pd.read_parquet(path) if filename.lower().endswith('.parquet') else pd.read_csv(path)
+
+        missing_columns = [column for column in ['Name', 'Date', 'Hours Worked', 'Time Period', 'Charge Code'] if column not in self.df.columns]
+        if missing_columns:
+            error_text = f'The timesheet {filename} is missing the {missing_columns} columns.'
+            logging.error(error_text)
+            raise IndexError(error_text)
+
+    def close(self):
+        pass
+
+    def sheet_states(self) -> list[tuple[str, bool]]:
+        # Charge codes in the order they first appear
+        return [(str(charge_code), True) for charge_code in self.df['Charge Code'].dropna().unique()]
+
+    def read_sheet(self, sheet_name) -> pd.DataFrame:
+        df = self.df.loc[self.df['Charge Code'].astype(str) == sheet_name, ['Name', 'Date', 'Hours Worked', 'Time Period']]
+        return whole_number_columns(df.replace('', np.nan).reset_index(drop=True))
+
+
+def open_input_workbook(filename, folder='input', engine=input_engine) -> InputWorkbook:
+    """
+    Pick the reader for an input file, 'auto' uses python-calamine for workbooks when it is installed and openpyxl otherwise
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    if extension in ['.csv', '.parquet']:
+        return TimesheetFile(filename, folder)
+
+    if engine == 'auto':
+        engine = 'calamine' if importlib.util.find_spec('python_calamine') else 'openpyxl'
+    if engine == 'calamine':
+        return CalamineWorkbook(filename, folder)
+
+    if extension == '.xls':
+        error_text = f'{filename} is an .xls workbook, which can only be read with the python-calamine package installed.'
+        logging.error(error_text)
+        raise ValueError(error_text)
+    return InputWorkbook(filename, folder)
+
+
+def frame_from_sheet_rows(sheet_rows) -> pd.DataFrame:
+    """
+    Find the header row and data range and read the Name, Date, Hours Worked and Time Period columns in one pass
+    """
+    header = None
+    rows = []
+    last_data_row = 0
+    for row_idx, row in enumerate(sheet_rows):
+        row = tuple(row) + (None,) * (5 - len(row))
+
+        # The header row has 'Name' in column A
+        if header is None:
+            if row[0] == 'Name':
+                header = row
+                header_row_idx = row_idx
+            continue
+
+        # Skip blank rows like read_excel does
+        values = (row[0], row[2], row[3], row[4])
+        if all(value is None or value == '' for value in values):
+            continue
+        rows.append(values)
+
+        # Track the last non-empty cell in the first column to determine how many rows of data there are
+        if row[0] is not None and row[0] != '':
+            last_data_row = len(rows)
+
+    if header is None:
         error_text = 'A name header was not located. Please ensure the headers are correct.'
-        logging.exception(error_text)
+        logging.error(error_text)
         raise IndexError(error_text)
 
-    # The header is expected to be right after the 'Name' row
-    header_row_idx = name_row_idx + 1
     if header_row_idx > 10:
-        error_text = f'Please insure that the proper headers are include in the input file. It appears a little high at row {name_row_idx}'
-        logging.warn(error_text)
-
-    # Find the last non-empty cell in the first column to determine how many rows of data there are
-    non_empty_rows = df_full.iloc[:, 0].dropna().index
-    last_data_row_idx = non_empty_rows[-1] if non_empty_rows.size > 0 else header_row_idx
-
-    # Calculate number of rows to read
-    nrows = last_data_row_idx - header_row_idx + 1
-
-    # Now read the required range using the correct header row
-    df = pd.read_excel(
-        f'input/{filename}',
-        sheet_name=sheet_name,
-        usecols=[0, 2, 3, 4],  # Adjust as needed to read the correct columns
-        skiprows=list(range(header_row_idx)),  # Skip all rows up to the header row
-        nrows=nrows,
-        header=0,  # Now the first row of data read will be treated as the header
-        engine='openpyxl'
-    )
+        error_text = f'Please insure that the proper headers are include in the input file. It appears a little high at row {header_row_idx - 1}'
+        logging.warning(error_text)
+
+    columns = [header[i] if header[i] is not None and header[i] != '' else f'Unnamed: {i}' for i in (0, 2, 3, 4)]
+    df = pd.DataFrame(rows[:last_data_row], columns=columns)
+    return whole_number_columns(df.replace('', np.nan))
+
+
+def whole_number_columns(df: pd.DataFrame) -> pd.DataFrame:
+    # read_excel stores whole number floats as integers
+    for column in df.columns:
+        if df[column].dtype == float and df[column].notna().all() and (df[column] % 1 == 0).all():
+            df[column] = df[column].astype(int)
+    return df
+
+
+def read_excel_data(input_workbook: InputWorkbook, sheet_name) -> pd.DataFrame:
+    logging.info(f"The current sheet is: {sheet_name}")
+
+    # Read the data below the 'Name' header from the already open workbook
+    df = input_workbook.read_sheet(sheet_name)
 
     # Convert the column to datetime format (if not already)
     try:
@@ -79,8 +309,10 @@ def read_excel_data(filename, sheet_name) -> pd.DataFrame:
         logging.exception(error_text)
         raise TypeError(error_text)
 
-    # Reformat the datetime to MM/DD/YYYY format
-    df['Date'] = df['Date'].dt.strftime('%m/%d/%Y')
+    # Reformat the datetime to MM/DD/YYYY format once per distinct date, the strings are kept as a categorical whose categories are
+    # the sorted strings so sorting by Date still orders rows like the strings (01/02/2024 before 12/30/2023)
+    date_strings = df['Date'].astype('category').map(lambda date: date.strftime('%m/%d/%Y'), na_action='ignore').astype(object)
+    df['Date'] = pd.Categorical(date_strings, categories=sorted(date_strings.dropna().unique()))
 
     # Add charge code to dataframe to track charge codes
     df['Charge Code'] = sheet_name
@@ -90,11 +322,98 @@ def read_excel_data(filename, sheet_name) -> pd.DataFrame:
     return df
 
 
-def copy_and_rename_excel(filename, invoice_sheet_names):
+def organized_invoice_path(filename, output_folder='output') -> str:
+    # The organized invoice is named after the part of the invoice filename before " Invoice"
+    destination_filename = os.path.basename(filename).split(" Invoice")[0]
+    return os.path.join(output_folder, f'{destination_filename} Organized Invoice.xlsx')
+
+
+def remove_organized_invoice(destination_path):
+    # Delete destination workbook if it exists, only done when a new one is built
+    try:
+        os.remove(destination_path)
+        logging.warning(f"{destination_path} has been deleted.")
+    except FileNotFoundError:
+        logging.debug(f"{destination_path} not found.")
+
+
+def copy_and_rename_excel(filename, invoice_sheet_names, output_folder='output') -> 'OutputWorkbook':
     # Filenames
-    destination_filename = filename.split(" Invoice")[0]
     source_path = 'config/sheet_template.xlsx'
-    destination_path = f'output/{destination_filename} Organized Invoice.xlsx'
+    destination_path = organized_invoice_path(filename, output_folder)
+    remove_organized_invoice(destination_path)
+
+    # Build the charge code sheets from the template
+    if template_engine == 'excel':
+        copy_template_with_excel(source_path, destination_path, invoice_sheet_names)
+        workbook = openpyxl.load_workbook(destination_path)
+    else:
+        workbook = clone_template_workbook(source_path, invoice_sheet_names)
+
+    logging.info(f"Appended sheets from {source_path} to {destination_path}.")
+    return OutputWorkbook(destination_path, workbook)
+
+
+@functools.lru_cache(maxsize=4)
+def read_template_bytes(source_path, modified_time) -> bytes:
+    """
+    Template file contents, read once per process until the template is modified
+    """
+    with open(source_path, 'rb') as file:
+        return file.read()
+
+
+def clone_template_workbook(source_path, invoice_sheet_names) -> openpyxl.Workbook:
+    """
+    Build the {charge_code}_Problem/Detail/Summary sheets and Mismatch from the template in memory
+    """
+    workbook = openpyxl.load_workbook(io.BytesIO(read_template_bytes(source_path, os.stat(source_path).st_mtime_ns)))
+
+    # Copy the untouched template sheets for every charge code after the first one
+    for invoice_sheet_name in invoice_sheet_names[1:]:
+        for sheet_name in template_sheets:
+            if sheet_name == "Mismatch":
+                continue
+
+            # Copy the source sheet to the front of the workbook like Excel's Copy(Before=sheets[0])
+            source_sheet = workbook[sheet_name]
+            target_sheet = workbook.copy_worksheet(source_sheet)
+            copy_sheet_layout(source_sheet, target_sheet)
+            workbook.move_sheet(target_sheet, -workbook.index(target_sheet))
+            target_sheet.title = f'{invoice_sheet_name}_{sheet_name}'
+
+    # The template sheets themselves become the first charge code's sheets
+    for sheet_name in template_sheets:
+        if sheet_name != "Mismatch" and invoice_sheet_names:
+            workbook[sheet_name].title = f'{invoice_sheet_names[0]}_{sheet_name}'
+
+    return workbook
+
+
+def copy_sheet_layout(source_sheet, target_sheet):
+    """
+    Copy the sheet settings openpyxl's copy_worksheet leaves behind
+    """
+    target_sheet.views = copy.deepcopy(source_sheet.views)
+    target_sheet.sheet_view.tabSelected = False  # Selected copies would open as grouped sheets
+    target_sheet.freeze_panes = source_sheet.freeze_panes
+    target_sheet.print_title_rows = source_sheet.print_title_rows
+    target_sheet.print_title_cols = source_sheet.print_title_cols
+    target_sheet.HeaderFooter = copy.copy(source_sheet.HeaderFooter)
+    if source_sheet.print_area:
+        target_sheet.print_area = source_sheet.print_area
+    for conditional_format in source_sheet.conditional_formatting:
+        for rule in conditional_format.rules:
+            target_sheet.conditional_formatting.add(str(conditional_format.sqref), copy.copy(rule))
+    for data_validation in source_sheet.data_validations.dataValidation:
+        target_sheet.add_data_validation(copy.copy(data_validation))
+
+
+def copy_template_with_excel(source_path, destination_path, invoice_sheet_names):
+    """
+    Fallback that copies the template sheets through a hidden Excel instance, only works where Excel is installed
+    """
+    import xlwings as xw
 
     # If destination file does not exist, create it by copying the source file
     if not os.path.exists(destination_path):
@@ -124,8 +443,8 @@ def copy_and_rename_excel(filename, invoice_sheet_names):
             # Rename the copied sheet in the target workbook
             target_wb.sheets[sheet_name].name = f'{invoice_sheet_name}_{sheet_name}'
 
-            # Save and close the target workbook
-            target_wb.save()
+    # Save and close the target workbook
+    target_wb.save()
     target_wb.close()
 
     # Close the source workbook without saving changes
@@ -134,13 +453,89 @@ def copy_and_rename_excel(filename, invoice_sheet_names):
     # Quit the app instance to close Excel
     app.quit()
 
-    logging.info(f"Appended sheets from {source_path} to {destination_path}.")
-    return destination_path
 
+class OutputWorkbook():
+    """
+    Organized invoice workbook held in memory for the whole invoice and written to disk once
+    """
+    def __init__(self, filename, workbook=None, checkpoint_every=output_checkpoint_every) -> None:
+        self.filename = filename
+        self.workbook = workbook if workbook is not None else openpyxl.load_workbook(filename)
 
-def paste_all_to_excel(dataframes: dict[str, pd.DataFrame], excel_file, invoice_sheet_name):
-    # Load the existing workbook
-    workbook = openpyxl.load_workbook(excel_file)
+        # Save every n charge codes when set, otherwise only save at the end
+        self.checkpoint_every = checkpoint_every
+        self.sheets_since_save = 0
+
+    def checkpoint(self):
+        if not self.checkpoint_every:
+            return
+
+        self.sheets_since_save += 1
+        if self.sheets_since_save >= self.checkpoint_every:
+            self.save()
+
+    def save(self):
+        self.workbook.save(self.filename)
+        self.sheets_since_save = 0
+        logging.info(f"Saved {self.filename}")
+
+
+def write_block(worksheet, df: pd.DataFrame, anchor, header=True, skip_empty=False):
+    """
+    Write a DataFrame with its first row at the anchor from the settings, the headers go in the row above
+
+    Missing values are written as empty cells, rows where skip_empty is set (a bool or one per row) leave those cells untouched
+    """
+    # The whole block is converted once, pandas missing values become None
+    values = df.astype(object).where(df.notna(), None).to_numpy()
+    skip_empty = np.broadcast_to(skip_empty, len(values))
+    if header:
+        write_rows(worksheet, [df.columns], anchor['row'] - 1, anchor['col'])
+    write_rows(worksheet, values, anchor['row'], anchor['col'], skip_empty)
+
+
+# Data types openpyxl infers for these value types, values of any other type go through the cell's value setter
+CELL_DATA_TYPES = {str: 's', int: 'n', float: 'n', bool: 'b', type(None): 'n'}
+
+
+def write_rows(worksheet, rows, start_row, start_col, skip_empty=None):
+    """
+    Set the cells of a block of rows, values openpyxl would store unchanged are bound straight to the cell
+
+    This depends on private openpyxl internals: the worksheet._cells table, creating Cell(worksheet, row, column) directly, setting
+    cell._value and cell.data_type without the value setter and ILLEGAL_CHARACTERS_RE from openpyxl.cell.cell. They are only known
+    to hold for openpyxl 3.1, don't loosen the <3.2 pin in config/requirements.txt without re-running test_write_rows_matches_value_setter,
+    which compares the result with openpyxl's own value setter
+    """
+    # One scan over every string of the block stands in for openpyxl's illegal character check on each cell
+    block_text = '\n'.join(value for row_values in rows for value in row_values if type(value) is str)
+    strings_allowed = ILLEGAL_CHARACTERS_RE.search(block_text) is None
+
+    # Cells are created directly in the sheet's cell table, cells from the template keep their style
+    cells = worksheet._cells
+    for r, row_values in enumerate(rows, start=start_row):
+        skip_row = skip_empty is not None and skip_empty[r - start_row]
+        for c, value in enumerate(row_values, start=start_col):
+            if value is None and skip_row:
+                continue
+            cell = cells.get((r, c))
+            if cell is None:
+                cell = cells[(r, c)] = Cell(worksheet, row=r, column=c)
+
+            # Formulas, error codes and strings openpyxl would truncate or reject are left to the value setter
+            data_type = CELL_DATA_TYPES.get(type(value))
+            if data_type is None or data_type == 's' and not (strings_allowed and len(value) <= 32767 and value[:1] not in '=#'):
+                cell.value = value
+            else:
+                cell._value = value
+                cell.data_type = data_type
+
+
+def paste_all_to_excel(dataframes: dict[str, pd.DataFrame], output_workbook: OutputWorkbook, invoice_sheet_name) -> pd.DataFrame | None:
+    """
+    Paste the cleaned frames into the charge code sheets, the summary block written is returned so formatting can reuse it
+    """
+    workbook = output_workbook.workbook
 
     all_df_empty = True
     for key, df in dataframes.items():
@@ -160,22 +555,10 @@ def paste_all_to_excel(dataframes: dict[str, pd.DataFrame], excel_file, invoice_
         detail_sheet = workbook[detail_sheet_name]
 
         # Paste problem DataFrame headers and data for 'Name' and 'Date' columns
-        problem_headers = df[['Name', 'Date']].columns
-        for c, header in enumerate(problem_headers, start=problem_loc[key]['col']):
-            problem_sheet.cell(row=problem_loc[key]['row'] - 1, column=c).value = header
-
-        for r, row_data in enumerate(df[['Name', 'Date']].values, start=problem_loc[key]['row']):
-            for c, value in enumerate(row_data, start=problem_loc[key]['col']):
-                problem_sheet.cell(row=r, column=c).value = value
+        write_block(problem_sheet, df[['Name', 'Date']], problem_loc[key])
 
         # Paste detail DataFrame headers and data
-        detail_headers = df.columns
-        for c, header in enumerate(detail_headers, start=detail_loc[key]['col']):
-            detail_sheet.cell(row=detail_loc[key]['row'] - 1, column=c).value = header
-
-        for r, row_data in enumerate(df.values, start=detail_loc[key]['row']):
-            for c, value in enumerate(row_data, start=detail_loc[key]['col']):
-                detail_sheet.cell(row=r, column=c).value = value
+        write_block(detail_sheet, df, detail_loc[key])
         logging.debug(f"Pasted sheet {key}")
 
     # If all dataframes are empty, delete the sheets
@@ -183,7 +566,6 @@ def paste_all_to_excel(dataframes: dict[str, pd.DataFrame], excel_file, invoice_
         for sheet_name in [f'{invoice_sheet_name}_Problem', f'{invoice_sheet_name}_Detail']:
             if sheet_name in workbook.sheetnames:
                 del workbook[sheet_name]
-                workbook.save(excel_file)
 
     # Paste summary DataFrame headers and data
     summary_sheet_name = f'{invoice_sheet_name}_Summary'
@@ -194,53 +576,23 @@ def paste_all_to_excel(dataframes: dict[str, pd.DataFrame], excel_file, invoice_
 
     if summary_df.empty:
         del workbook[summary_sheet_name]
-        workbook.save(excel_file)
         logging.info('The summary sheet is empty. Deleted the summary sheet')
-        return
+        return None
 
-    try:
-        previous_name = summary_df.loc[0, 'Name']
-        previous_subtotal = summary_df.loc[0, 'Subtotal']
-    except Exception as e:
-        logging.info(f'There is an error: {e}. The summary dataframe is: {summary_df}')
-        raise
-
-    df_rows = summary_df[['Name', 'Date', 'Total Hours Worked', 'Formatted Time Comments', 'Subtotal']].values
-    write_row = summary_loc[key]['row']
-
-    for r, row_data in enumerate(df_rows, start=1):
-        current_name = row_data[0]
-        subtotal = row_data[4]
-
-        # Check if the name has changed or it's the last row
-        is_last_row = (r == len(df_rows))
-        if current_name != previous_name:
-            # Insert subtotal row and bold the text
-            summary_sheet.cell(row=write_row, column=summary_loc[key]['col']).value = previous_name
-            summary_sheet.cell(row=write_row, column=summary_loc[key]['col'] + 3).value = f'Subtotal: {previous_subtotal} Hours'
-            # summary_sheet.cell(row=write_row, column=summary_loc[key]['col'] + 3).font = Font(bold=True) Removed I wasn't a big fan of how it looked
-            summary_sheet.cell(row=write_row, column=summary_loc[key]['col'] + 3).alignment = Alignment(horizontal='right')
-            write_row += 1
-
-            # Update previous_name and increment write_row for the next data entry
-            previous_name = current_name
-            previous_subtotal = subtotal
-
-        # Write current row data to the Excel sheet
-        for c, value in enumerate(row_data[:-1], start=summary_loc[key]['col']):  # row_data[:-1] skips subtotal column
-            summary_sheet.cell(row=write_row, column=c).value = value
-        write_row += 1
-
-        if is_last_row:
-            # Insert subtotal row and bold the text
-            summary_sheet.cell(row=write_row, column=summary_loc[key]['col']).value = f'{previous_name or current_name}'
-            summary_sheet.cell(row=write_row, column=summary_loc[key]['col'] + 3).value = f'Subtotal: {subtotal} Hours'
-            # summary_sheet.cell(row=write_row, column=summary_loc[key]['col'] + 3).font = Font(bold=True) Removed I wasn't a big fan of how it looked
-            summary_sheet.cell(row=write_row, column=summary_loc[key]['col'] + 3).alignment = Alignment(horizontal='right')
+    # Data rows with a subtotal row after every name, the subtotal rows only fill the name and comment columns
+    summary_block = build_summary_block(summary_df)
+    subtotal_rows = summary_block['Subtotal Row'].to_numpy()
+    write_block(summary_sheet, summary_block.drop(columns='Subtotal Row'), summary_loc[key], header=False, skip_empty=subtotal_rows)
+
+    # Right align the subtotals
+    # Font(bold=True) was removed from the subtotals, I wasn't a big fan of how it looked
+    subtotal_alignment = Alignment(horizontal='right')
+    for r in np.flatnonzero(subtotal_rows) + summary_loc[key]['row']:
+        summary_sheet.cell(row=int(r), column=summary_loc[key]['col'] + 3).alignment = subtotal_alignment
 
     # Insert Month in summary
-    month = excel_file.split()[1]
-    year = excel_file.split()[2]
+    month = os.path.basename(output_workbook.filename).split()[1]
+    year = os.path.basename(output_workbook.filename).split()[2]
     month_text = f'Month: {month} {year}'
     # contract_number = f'Contract Number: {invoice_sheet_name}'
 
@@ -249,47 +601,54 @@ def paste_all_to_excel(dataframes: dict[str, pd.DataFrame], excel_file, invoice_
 
     # Insert the value into the specified cell
     summary_sheet["B6"] = month_text
-
-    # Save the workbook
-    workbook.save(excel_file)
     logging.info("Pasted problematic data into relevant sheets")
-    return
-
-
-def list_visible_sheets_in_workbook(workbook_path) -> tuple[str, pd.DataFrame]:
-    logging.info(f"The current workbook is: {workbook_path}")
-    destination_filename = workbook_path.split(" Invoice")[0]
-    destination_path = f'output/{destination_filename} Organized Invoice.xlsx'
-
-    # Load the workbook
-    workbook = openpyxl.load_workbook(f'input/{workbook_path}')
-
-    # Get the list of visible sheet names
-    visible_sheet_names = [sheet.title for sheet in workbook if sheet.sheet_state == 'visible']
+    return summary_block
 
-    # Filter out the sheet names that are in the blacklist
-    visible_sheet_names = [sheet for sheet in visible_sheet_names if sheet not in blacklist_charge_codes]
 
-    # Delete destination workbook if it exists
-    try:
-        os.remove(destination_path)
-        logging.warning(f"{destination_path} has been deleted.")
-    except FileNotFoundError:
-        logging.debug(f"{destination_path} not found.")
+def build_summary_block(summary_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Rows written to the summary sheet, a subtotal row follows every run of rows with the same name
+    """
+    columns = ['Name', 'Date', 'Total Hours Worked', 'Formatted Time Comments']
+    names = summary_df['Name'].reset_index(drop=True)
+    subtotals = summary_df['Subtotal'].reset_index(drop=True)
+    row_count = len(names.index)
+
+    # A subtotal row goes in front of every row whose name differs from the row above, and after the last row
+    name_changed = names.ne(names.shift()).to_numpy(copy=True)
+    name_changed[:1] = names.isna().to_numpy()[:1]
+    previous_rows = np.maximum(np.flatnonzero(name_changed) - 1, 0)
+    subtotal_rows = np.append(previous_rows, row_count - 1)
+
+    data_block = summary_df[columns].reset_index(drop=True).astype(object)
+    subtotal_block = pd.DataFrame({
+        'Name': names.iloc[subtotal_rows].to_numpy(),
+        'Formatted Time Comments': ('Subtotal: ' + subtotals.iloc[subtotal_rows].astype(str) + ' Hours').to_numpy()
+    })
+    subtotal_block['Subtotal Row'] = True
+
+    # Interleave the subtotal rows with the data rows in write order
+    data_block['Order'] = np.arange(row_count) * 2 + 1
+    subtotal_block['Order'] = np.append(np.flatnonzero(name_changed) * 2, row_count * 2)
+    block = pd.concat([data_block, subtotal_block], ignore_index=True).sort_values('Order', kind='stable')
+    block['Subtotal Row'] = block['Subtotal Row'].fillna(False).astype(bool)
+    return block.drop(columns='Order').reset_index(drop=True)
+
+
+def list_visible_sheets_in_workbook(input_workbook: InputWorkbook) -> list[str]:
+    logging.info(f"The current workbook is: {input_workbook.filename}")
+
+    # Get the list of visible, non blacklisted sheet names
+    visible_sheet_names = input_workbook.visible_sheet_names()
 
     logging.info(f'List of visible sheets: {visible_sheet_names}')
     return visible_sheet_names
 
 
-def find_workbook_list():
-    import os
-
-    # Specify the directory path
-    folder_path = 'input/'
-
-    # Get a list of all files in the directory that do not start with "~"
+def find_workbook_list(folder_path='input/'):
+    # Get a list of all workbooks and timesheet files in the directory that do not start with "~"
     file_list = [f for f in os.listdir(folder_path) if
-                 os.path.isfile(os.path.join(folder_path, f)) and not f.startswith('~') and f.endswith('.xlsx')]
+                 os.path.isfile(os.path.join(folder_path, f)) and not f.startswith('~') and os.path.splitext(f)[1].lower() in input_extensions]
     return file_list
 
 
@@ -303,10 +662,5 @@ def create_overbilled_sheet(overbilled_df: pd.DataFrame, worksheet: str):
         return True
 
     # Add data to overbilled worksheet including headers
-    for c, header in enumerate(overbilled_df.columns, start=overbilled_loc[key]['col']):
-        worksheet.cell(row=overbilled_loc[key]['row'] - 1, column=c).value = header
-
-    for r, row_data in enumerate(overbilled_df.values, start=overbilled_loc[key]['row']):
-        for c, value in enumerate(row_data, start=overbilled_loc[key]['col']):
-            worksheet.cell(row=r, column=c).value = value
+    write_block(worksheet, overbilled_df, overbilled_loc[key])
     return empty_df
@@ -0,0 +1,102 @@
+import logging
+import os
+import threading
+import time
+import utils.utils as ut
+from config.settings import watch_poll_seconds, watch_settle_seconds
+
+
+def start_observer(folder_path, wake_event):
+    """
+    Wake the watcher on file system events when watchdog is installed, otherwise the folder is only polled
+    """
+    try:
+        from watchdog.events import FileSystemEventHandler
+        from watchdog.observers import Observer
+    except ImportError:
+        logging.info(f'watchdog is not installed, polling {folder_path} every {watch_poll_seconds} seconds')
+        return None
+
+    class WakeHandler(FileSystemEventHandler):
+        def on_any_event(self, event):
+            wake_event.set()
+
+    observer = Observer()
+    observer.schedule(WakeHandler(), folder_path)
+    observer.start()
+    logging.info(f'Watching {folder_path} for file system events')
+    return observer
+
+
+class WorkbookWatcher():
+    """
+    Finds new or modified invoice workbooks in the input folder once they stop changing
+    """
+    def __init__(self, folder_path='input/', poll_seconds=watch_poll_seconds, settle_seconds=watch_settle_seconds, use_events=True) -> None:
+        self.folder_path = folder_path
+        self.poll_seconds = poll_seconds
+        self.settle_seconds = settle_seconds
+        self.processed = {}  # filename -> (size, modified time) when it was last handed out
+        self.pending = {}  # filename -> ((size, modified time), first seen with that signature)
+        self.wake_event = threading.Event()
+        self.observer = start_observer(folder_path, self.wake_event) if use_events else None
+
+    def is_ready(self, filename) -> bool:
+        # Excel keeps a ~$ lock file next to a workbook that is open
+        if os.path.exists(os.path.join(self.folder_path, f'~${filename}')):
+            return False
+
+        # A file that is still being copied can't be opened on Windows
+        try:
+            with open(os.path.join(self.folder_path, filename), 'rb'):
+                return True
+        except OSError:
+            return False
+
+    def scan(self) -> list[str]:
+        now = time.monotonic()
+        signatures = {}
+        for filename in ut.find_workbook_list(self.folder_path):
+            try:
+                stat = os.stat(os.path.join(self.folder_path, filename))
+            except FileNotFoundError:
+                continue
+            signatures[filename] = (stat.st_size, stat.st_mtime_ns)
+
+        # Forget deleted workbooks so they are processed again if they come back
+        self.processed = {filename: signature for filename, signature in self.processed.items() if filename in signatures}
+        self.pending = {filename: pending for filename, pending in self.pending.items() if filename in signatures}
+
+        ready_filenames = []
+        for filename, signature in signatures.items():
+            if self.processed.get(filename) == signature:
+                continue
+
+            # Restart the debounce whenever the size or modified time changes, a workbook has to look the same on two scans
+            pending_signature, first_seen = self.pending.get(filename, (None, now))
+            if pending_signature != signature:
+                self.pending[filename] = (signature, now)
+                continue
+
+            if now - first_seen >= self.settle_seconds and self.is_ready(filename):
+                del self.pending[filename]
+                self.processed[filename] = signature
+                ready_filenames.append(filename)
+        return sorted(ready_filenames)
+
+    def wait_for_workbooks(self) -> list[str]:
+        """
+        Block until at least one workbook is ready to be processed
+        """
+        while True:
+            ready_filenames = self.scan()
+            if ready_filenames:
+                return ready_filenames
+
+            self.wake_event.wait(self.poll_seconds)
+            self.wake_event.clear()
+
+    def stop(self):
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer.join()